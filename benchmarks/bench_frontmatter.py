@@ -0,0 +1,61 @@
+"""Micro-benchmark of the front matter of database rows: `parse_frontmatter`
+and `frontmatter_header` on pages sharing a schema.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_frontmatter
+
+The page count doubles at every step; the time per page stays flat, and
+drops with the number of pages sharing their dates.
+"""
+import time
+
+from parser.frontmatter_parser import parse_frontmatter
+from parser.markdown_parser import frontmatter_header
+from .bench_markdown import richtext
+
+REPEAT = 3
+
+
+def row(index: int) -> dict:
+    """A row of a task database, with a dozen properties and three dates"""
+    day = f"2024-{index % 12 + 1:02d}-{index % 28 + 1:02d}"
+    return {
+        "object": "page",
+        "id": f"page-{index}",
+        "properties": {
+            "Name": {"type": "title", "title": [richtext(f"Task {index}")]},
+            "Status": {"type": "select", "select": {"name": "In progress"}},
+            "Tags": {"type": "multi_select", "multi_select": [{"name": "bench"}, {"name": f"t{index % 7}"}]},
+            "Due Date": {"type": "date", "date": {"start": day, "end": None}},
+            "Created At": {"type": "created_time", "created_time": f"{day}T09:30:00.000Z"},
+            "Last-Edited": {"type": "last_edited_time", "last_edited_time": f"{day}T18:00:00.000Z"},
+            "Estimate": {"type": "number", "number": index % 13},
+            "Done": {"type": "checkbox", "checkbox": bool(index % 2)},
+            "Owner": {"type": "people", "people": [{"name": "Ada"}]},
+            "Notes": {"type": "rich_text", "rich_text": [richtext("Some "), richtext("notes", bold=True)]},
+            "Contact": {"type": "email", "email": "ada@example.com"},
+            "Link": {"type": "url", "url": "https://example.com"},
+        },
+    }
+
+
+def bench(size: int) -> float:
+    best = float("inf")
+    for _ in range(REPEAT):
+        pages = [row(index) for index in range(size)]
+        started_at = time.perf_counter()
+        for page in pages:
+            frontmatter_header(parse_frontmatter(page)["frontmatter"])
+        best = min(best, time.perf_counter() - started_at)
+    return best
+
+
+def main():
+    for size in (2_500, 5_000, 10_000, 20_000):
+        elapsed = bench(size)
+        print(f"  {size:>7} pages  {elapsed * 1000:9.2f} ms  {elapsed / size * 1e6:7.2f} µs/page")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Micro-benchmark of `parse_markdown` on synthetic deep and wide block trees.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_markdown
+
+For each tree shape the block count doubles at every step; with linear-time
+rendering the time per block stays flat.
+"""
+import sys
+import time
+
+from parser.markdown_parser import parse_markdown
+
+REPEAT = 5
+
+
+def richtext(text: str, **annotations) -> dict:
+    return {
+        "type": "text",
+        "plain_text": text,
+        "text": {"content": text, "link": None},
+        "href": None,
+        "annotations": {
+            "bold": False,
+            "italic": False,
+            "strikethrough": False,
+            "underline": False,
+            "code": False,
+            "color": "default",
+            **annotations,
+        },
+    }
+
+
+def block(block_type: str, children=None, **payload) -> dict:
+    result = {
+        "object": "block",
+        "id": f"{block_type}-{id(payload)}",
+        "type": block_type,
+        "has_children": bool(children),
+        block_type: payload,
+    }
+    if children:
+        result["children"] = children
+    return result
+
+
+def paragraph(index: int) -> dict:
+    return block("paragraph", rich_text=[
+        richtext(f"Paragraph {index} "),
+        richtext("with bold", bold=True),
+        richtext(" and "),
+        richtext("code", code=True),
+    ] * 4)
+
+
+def deep_tree(size: int) -> dict:
+    """A single chain of 'size' nested toggles, each with a paragraph"""
+    node = None
+    for index in range(size):
+        children = [paragraph(index)] + ([node] if node else [])
+        node = block("toggle", children, rich_text=[richtext(f"Toggle {index}")])
+    return {"results": [node]}
+
+
+def wide_tree(size: int) -> dict:
+    """A toggle with 'size' / 4 bulleted items, each with a code block and a
+    small table"""
+    items = []
+    for index in range(size // 4):
+        rows = [block("table_row", cells=[[richtext(f"{index}-{r}-{c}")] for c in range(3)]) for r in range(2)]
+        items.append(block("bulleted_list_item", [
+            block("code", rich_text=[richtext("a = 1\nb = 2")], language="python"),
+            block("table", rows, table_width=3),
+        ], rich_text=[richtext(f"Item {index}", italic=True)]))
+    return {"results": [block("toggle", items, rich_text=[richtext("Wide")])]}
+
+
+def bench(shape, size: int) -> float:
+    blocks = shape(size)
+    best = float("inf")
+    for _ in range(REPEAT):
+        started_at = time.perf_counter()
+        parse_markdown("bench", blocks, {"Tags": "a, b", "Created": "2023-01-01"})
+        best = min(best, time.perf_counter() - started_at)
+    return best
+
+
+def main():
+    sys.setrecursionlimit(20_000)
+    for shape, sizes in ((deep_tree, (1_000, 2_000, 4_000, 8_000)), (wide_tree, (2_000, 8_000, 32_000, 128_000))):
+        print(shape.__name__)
+        for size in sizes:
+            elapsed = bench(shape, size)
+            print(f"  {size:>7} blocks  {elapsed * 1000:9.2f} ms  {elapsed / size * 1e6:7.2f} µs/block")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""A local stand-in for the Notion API serving synthetic databases.
+
+Run it on its own and point the exporter at it with `--base-url`:
+
+    python -m benchmarks.fake_notion --port 8765 --pages 1000 --depth 3
+    python parallel_n2md.py -p fake -d fake-db --base-url http://127.0.0.1:8765 --rate 1000
+
+Any database id can be queried, and search lists 'databases' of them.
+Every database has 'pages' pages. A page has 'top_blocks' top-level blocks;
+blocks above 'depth' have 'width' children, the first 'branching' of which
+have children of their own. Lists are paginated by 'page_size', responses
+are delayed by about 'latency' seconds, and a 'throttle_rate' fraction of the
+requests is answered with a 429.
+"""
+import argparse
+import asyncio
+import random
+from dataclasses import asdict, dataclass
+
+from aiohttp import web
+
+from .bench_markdown import richtext
+
+BLOCK_TYPES = ("paragraph", "heading_2", "bulleted_list_item", "code", "to_do", "quote")
+PARENT_TYPES = ("toggle", "bulleted_list_item", "numbered_list_item")
+EDITED_AT = "2024-01-01T00:00:00.000Z"
+
+
+@dataclass
+class FakeWorkspace:
+    databases: int = 1
+    pages: int = 100
+    top_blocks: int = 20
+    depth: int = 2
+    width: int = 3
+    branching: int = 3
+    page_size: int = 100
+    latency: float = 0.0
+    throttle_rate: float = 0.0
+    retry_after: float = 0.1
+
+
+def page_object(database_id: str, page_id: str) -> dict:
+    index = int(page_id.rsplit("-", 1)[1])
+    return {
+        "object": "page",
+        "id": page_id,
+        "created_time": EDITED_AT,
+        "last_edited_time": EDITED_AT,
+        "parent": {"type": "database_id", "database_id": database_id},
+        "cover": None,
+        "icon": None,
+        "archived": False,
+        "properties": {
+            "Name": {"id": "title", "type": "title", "title": [richtext(f"Page {index}")]},
+            "Tags": {"id": "tags", "type": "multi_select", "multi_select": [{"name": "bench"}, {"name": f"t{index % 7}"}]},
+            "Status": {"id": "status", "type": "select", "select": {"name": "Published"}},
+            "Date": {"id": "date", "type": "date", "date": {"start": "2024-01-01", "end": None}},
+            "Created": {"id": "created", "type": "created_time", "created_time": EDITED_AT},
+        },
+    }
+
+
+def block_object(block_id: str, index: int, has_children: bool) -> dict:
+    block_type = PARENT_TYPES[index % len(PARENT_TYPES)] if has_children else BLOCK_TYPES[index % len(BLOCK_TYPES)]
+    payload = {
+        "rich_text": [
+            richtext(f"Block {block_id} "),
+            richtext("bold", bold=True),
+            richtext(" and "),
+            richtext("colored", italic=True, color="red"),
+        ],
+    }
+    if block_type == "code":
+        payload["language"] = "python"
+        payload["rich_text"] = [richtext("def f():\n    return 1")]
+    if block_type == "to_do":
+        payload["checked"] = bool(index % 2)
+    return {
+        "object": "block",
+        "id": block_id,
+        "type": block_type,
+        "created_time": EDITED_AT,
+        "last_edited_time": EDITED_AT,
+        "has_children": has_children,
+        block_type: payload,
+    }
+
+
+def children_of(workspace: FakeWorkspace, block_id: str) -> list:
+    # Block ids are '{page_id}_{index}_{index}...', one index per level
+    level = block_id.count("_")
+    count = workspace.top_blocks if level == 0 else workspace.width
+    return [
+        block_object(
+            f"{block_id}_{index}",
+            index,
+            level + 1 < workspace.depth and (level == 0 or index < workspace.branching),
+        )
+        for index in range(count)
+    ]
+
+
+def paginated(results: list, start_cursor, page_size: int) -> dict:
+    start = int(start_cursor or 0)
+    end = start + page_size
+    next_cursor = str(end) if end < len(results) else None
+    return {
+        "object": "list",
+        "results": results[start:end],
+        "next_cursor": next_cursor,
+        "has_more": next_cursor is not None,
+        "type": "block",
+    }
+
+
+@web.middleware
+async def simulate_api(request, handler):
+    workspace = request.app["workspace"]
+    if workspace.latency:
+        await asyncio.sleep(workspace.latency * random.uniform(0.5, 1.5))
+    if random.random() < workspace.throttle_rate:
+        return web.json_response(
+            {"object": "error", "status": 429, "code": "rate_limited", "message": "Rate limited"},
+            status=429,
+            headers={"Retry-After": str(workspace.retry_after)},
+        )
+    return await handler(request)
+
+
+async def query_database(request):
+    workspace = request.app["workspace"]
+    database_id = request.match_info["database_id"]
+    body = await request.json() if request.can_read_body else {}
+    page_size = min(body.get("page_size", workspace.page_size), workspace.page_size)
+    page_ids = [f"{database_id}-page-{index}" for index in range(workspace.pages)]
+    response = paginated(page_ids, body.get("start_cursor"), page_size)
+    response["results"] = [page_object(database_id, page_id) for page_id in response["results"]]
+    response["type"] = "page"
+    return web.json_response(response)
+
+
+def database_object(database_id: str) -> dict:
+    return {
+        "object": "database",
+        "id": database_id,
+        "title": [richtext(database_id)],
+        "properties": page_object(database_id, f"{database_id}-page-0")["properties"],
+    }
+
+
+async def retrieve_database(request):
+    return web.json_response(database_object(request.match_info["database_id"]))
+
+
+async def search(request):
+    workspace = request.app["workspace"]
+    body = await request.json() if request.can_read_body else {}
+    database_ids = [f"fake-db-{index}" for index in range(workspace.databases)]
+    response = paginated(database_ids, body.get("start_cursor"), min(body.get("page_size", 100), 100))
+    response["results"] = [database_object(database_id) for database_id in response["results"]]
+    response["type"] = "page_or_database"
+    return web.json_response(response)
+
+
+async def retrieve_page(request):
+    page_id = request.match_info["page_id"]
+    database_id = page_id.rsplit("-page-", 1)[0]
+    return web.json_response(page_object(database_id, page_id))
+
+
+async def list_children(request):
+    workspace = request.app["workspace"]
+    page_size = min(int(request.query.get("page_size", workspace.page_size)), workspace.page_size)
+    children = children_of(workspace, request.match_info["block_id"])
+    return web.json_response(paginated(children, request.query.get("start_cursor"), page_size))
+
+
+def make_app(workspace: FakeWorkspace) -> web.Application:
+    app = web.Application(middlewares=[simulate_api])
+    app["workspace"] = workspace
+    app.router.add_post("/v1/databases/{database_id}/query", query_database)
+    app.router.add_get("/v1/databases/{database_id}", retrieve_database)
+    app.router.add_post("/v1/search", search)
+    app.router.add_get("/v1/pages/{page_id}", retrieve_page)
+    app.router.add_get("/v1/blocks/{block_id}/children", list_children)
+    return app
+
+
+def serve(workspace: FakeWorkspace, port: int):
+    web.run_app(make_app(workspace), host="127.0.0.1", port=port, print=None, access_log=None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--port", type=int, default=8765)
+    for field, default in asdict(FakeWorkspace()).items():
+        parser.add_argument(f"--{field.replace('_', '-')}", type=type(default), default=default)
+    args = vars(parser.parse_args())
+    port = args.pop("port")
+    serve(FakeWorkspace(**args), port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""End-to-end export benchmarks against the local fake Notion API.
+
+Run from the repository root:
+
+    python -m benchmarks.run
+    python -m benchmarks.run --scenario deep-toggles --scale 0.1
+
+Each scenario starts `benchmarks.fake_notion` in its own process, exports its
+database into a temporary directory from a fresh process (so metrics and
+peak RSS are not shared between scenarios), and reports pages per second,
+p50/p99 page latency and the peak RSS of the exporter and its render workers.
+With `--stream`, pages are rendered as their blocks are fetched, see
+`exporter.stream`; compare the peak RSS of "huge-page" with and without it.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import socket
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import replace
+
+from exporter.client import ExportClient
+from exporter.metrics import metrics
+from exporter.pipeline import download_database
+from exporter.scheduler import RequestScheduler
+from .fake_notion import FakeWorkspace, serve
+
+SCENARIOS = {
+    "10k-pages": FakeWorkspace(pages=10_000, top_blocks=10, depth=1),
+    "5k-block-page": FakeWorkspace(pages=1, top_blocks=5_000, depth=1, page_size=100),
+    "huge-page": FakeWorkspace(pages=1, top_blocks=10_000, depth=2, branching=1),
+    "deep-toggles": FakeWorkspace(pages=20, top_blocks=1, depth=40, width=1, branching=1),
+    "throttled": FakeWorkspace(pages=200, top_blocks=20, depth=2, latency=0.02, throttle_rate=0.05),
+}
+# The fake API is local, so the client is only bounded by its own concurrency
+SCHEDULER_OPTIONS = {"rate": 100_000.0, "burst": 1_000, "max_concurrency": 32, "target_latency": 5.0}
+
+
+def scaled(workspace: FakeWorkspace, scale: float) -> FakeWorkspace:
+    """The scenario with its largest dimension multiplied by 'scale'"""
+    if workspace.pages > 1:
+        return replace(workspace, pages=max(1, int(workspace.pages * scale)))
+    return replace(workspace, top_blocks=max(1, int(workspace.top_blocks * scale)))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port: int, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+async def export(port: int, render_workers: int, stream=False):
+    with ProcessPoolExecutor(max_workers=render_workers) as executor:
+        async with ExportClient(
+            RequestScheduler(**SCHEDULER_OPTIONS),
+            base_url=f"http://127.0.0.1:{port}",
+            auth="bench",
+            log_level=logging.WARNING,
+        ) as notion:
+            await download_database(
+                notion, "bench", "bench-db",
+                page_concurrency=16, executor=executor, render_workers=render_workers, stream=stream,
+            )
+
+
+def run_export(port: int, render_workers: int, stream, results):
+    # Injected 429s are expected, their retry warnings are not news
+    logging.basicConfig(level=logging.ERROR)
+    os.chdir(tempfile.mkdtemp(prefix="n2md-bench-"))
+    started_at = time.perf_counter()
+    asyncio.run(export(port, render_workers, stream))
+    elapsed = time.perf_counter() - started_at
+
+    report = metrics.to_dict()
+    # ru_maxrss is in kilobytes on Linux; children are the reaped render workers
+    peak_rss = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    results.put({
+        "seconds": elapsed,
+        "pages": report["pages"]["count"],
+        "pages_per_second": report["pages"]["count"] / elapsed,
+        "p50_seconds": report["pages"]["p50_seconds"],
+        "p99_seconds": report["pages"]["p99_seconds"],
+        "api_calls": sum(stats["calls"] for stats in report["api"].values()),
+        "throttled": report["throttled"],
+        "peak_rss_mb": peak_rss / 1024,
+    })
+
+
+def run_scenario(workspace: FakeWorkspace, render_workers: int, stream=False) -> dict:
+    context = multiprocessing.get_context("spawn")
+    port = free_port()
+    server = context.Process(target=serve, args=(workspace, port), daemon=True)
+    server.start()
+    try:
+        wait_for_port(port)
+        results = context.Queue()
+        exporter = context.Process(target=run_export, args=(port, render_workers, stream, results))
+        exporter.start()
+        result = results.get()
+        exporter.join()
+        return result
+    finally:
+        server.terminate()
+        server.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS, help="defaults to every scenario")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplies the size of the scenarios")
+    parser.add_argument("--render-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--stream", action="store_true", help="renders pages as their blocks are fetched")
+    parser.add_argument("--json", help="also writes the results to this file")
+    args = parser.parse_args()
+
+    results = {}
+    print(f"{'scenario':<16} {'pages':>7} {'seconds':>8} {'pages/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'calls':>7} {'429s':>5} {'rss MB':>7}")
+    for name in args.scenario or SCENARIOS:
+        result = results[name] = run_scenario(scaled(SCENARIOS[name], args.scale), args.render_workers, args.stream)
+        print(
+            f"{name:<16} {result['pages']:>7} {result['seconds']:>8.2f} {result['pages_per_second']:>9.1f} "
+            f"{result['p50_seconds'] * 1000:>8.1f} {result['p99_seconds'] * 1000:>8.1f} "
+            f"{result['api_calls']:>7} {result['throttled']:>5} {result['peak_rss_mb']:>7.1f}"
+        )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from urllib.parse import urlparse
+
+import aiohttp
+
+from parser.frontmatter_parser import recursive_search
+from .writer import write_atomic
+
+ASSETS_DIR = "assets"
+ASSETS_INDEX_NAME = "assets.json"
+CHUNK_SIZE = 1 << 16
+# Downloaded chunks are written off the event loop in batches of this size
+WRITE_SIZE = 1 << 20
+
+
+def asset_urls(page: dict, blocks: dict) -> list:
+    """The URLs of the files Notion hosts for a page (images, files, videos
+    and files properties), which are presigned and expire after an hour."""
+    files = list(recursive_search("file", page.get("properties", {}))) + list(recursive_search("file", blocks))
+    return sorted({file["url"] for file in files if isinstance(file, dict) and "url" in file})
+
+
+def asset_key(url: str) -> str:
+    """The URL of a file without its presigned query, the same across exports"""
+    parsed = urlparse(url)
+    return f"{parsed.netloc}{parsed.path}"
+
+
+def localize_assets(page_md: str, urls: list, index: dict) -> str:
+    """Points the links of 'page_md' to the 'urls' stored in 'index' at the
+    stored files, relative to the page."""
+    for url in urls:
+        name = index.get(asset_key(url))
+        if name is not None:
+            page_md = page_md.replace(url, f"../{ASSETS_DIR}/{name}")
+    return page_md
+
+
+class AssetStore:
+    """Content-addressed store of the files of an export,
+    `build/{path}/assets/{sha256}{suffix}`.
+
+    `assets.json` maps each file (by `asset_key`) to its stored name, so a
+    file linked from several pages or exports is downloaded once, and files
+    with the same content are stored once. Downloads share the pooled
+    connections of 'session'.
+    """
+
+    def __init__(self, path: str, session: aiohttp.ClientSession = None, retries=2):
+        self.path = path
+        self.directory = f"build/{path}/{ASSETS_DIR}"
+        self.session = session
+        self.retries = retries
+        self.index = self.load_index(path)
+        # Downloads in flight, shared by the pages linking to the same file
+        self.downloads = {}
+
+    @staticmethod
+    def load_index(path: str) -> dict:
+        try:
+            with open(f"build/{path}/{ASSETS_INDEX_NAME}") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def save(self):
+        if self.index:
+            write_atomic(
+                f"build/{self.path}/{ASSETS_INDEX_NAME}",
+                json.dumps(self.index, indent=2, sort_keys=True).encode("utf-8"),
+            )
+
+    def localize(self, page_md: str, urls: list) -> str:
+        return localize_assets(page_md, urls, self.index)
+
+    async def fetch(self, url: str):
+        """Stores the file at 'url' unless it already is, returning its
+        stored name, or None when it cannot be downloaded."""
+        key = asset_key(url)
+        name = self.index.get(key)
+        if name is not None and os.path.exists(f"{self.directory}/{name}"):
+            return name
+        if key not in self.downloads:
+            self.downloads[key] = asyncio.ensure_future(self.download(url))
+            self.downloads[key].add_done_callback(lambda download: self._forget_failed(key, download))
+        return await asyncio.shield(self.downloads[key])
+
+    def _forget_failed(self, key: str, download: asyncio.Future):
+        # A later page linking to the file tries to download it again
+        if download.cancelled() or download.exception() is not None or download.result() is None:
+            if self.downloads.get(key) is download:
+                del self.downloads[key]
+
+    async def download(self, url: str):
+        for attempt in range(self.retries + 1):
+            try:
+                name = await self._download(url)
+                break
+            except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as error:
+                if attempt == self.retries:
+                    # The page keeps linking to Notion
+                    logging.warning(f"Failed to download {asset_key(url)}: {error}")
+                    return None
+        self.index[asset_key(url)] = name
+        return name
+
+    async def _download(self, url: str) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        suffix = os.path.splitext(urlparse(url).path)[1]
+        digest = hashlib.sha256()
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix=".download-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                async with self.session.get(url) as response:
+                    response.raise_for_status()
+                    buffered, buffered_size = [], 0
+                    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                        digest.update(chunk)
+                        buffered.append(chunk)
+                        buffered_size += len(chunk)
+                        if buffered_size >= WRITE_SIZE:
+                            await asyncio.to_thread(f.writelines, buffered)
+                            buffered, buffered_size = [], 0
+                    if buffered:
+                        await asyncio.to_thread(f.writelines, buffered)
+            name = digest.hexdigest() + suffix
+            if os.path.exists(f"{self.directory}/{name}"):
+                os.remove(temp_path)
+            else:
+                os.replace(temp_path, f"{self.directory}/{name}")
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return name
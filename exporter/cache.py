@@ -0,0 +1,67 @@
+import hashlib
+import json
+import os
+import tempfile
+from contextvars import ContextVar
+
+# The last_edited_time of the page whose content is being requested. Cached
+# responses recorded under another version are stale.
+cache_version = ContextVar("cache_version", default=None)
+
+
+class CacheMissError(Exception):
+    pass
+
+
+class ResponseCache:
+    """On-disk cache of API responses.
+
+    Responses are stored once under `objects/` by the hash of their content,
+    and `refs/` maps each request (method, endpoint path with its id, query
+    and body with the cursor) to a response and the version it was fetched at.
+    """
+
+    def __init__(self, root: str = "build/.cache"):
+        self.root = root
+
+    def request_key(self, path, method, query=None, body=None) -> str:
+        request = json.dumps([method, path, query or {}, body or {}], sort_keys=True)
+        return hashlib.sha256(request.encode("utf-8")).hexdigest()
+
+    def _path(self, kind: str, digest: str) -> str:
+        return os.path.join(self.root, kind, digest[:2], f"{digest}.json")
+
+    def _write(self, file_path: str, content: str):
+        directory = os.path.dirname(file_path)
+        os.makedirs(directory, exist_ok=True)
+        # Unique per write: concurrent requests of a process may store the same response
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".put-")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(content)
+            os.replace(tmp_path, file_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def get(self, key: str, version=None, any_version=False):
+        """Returns the cached response for 'key' if it was recorded at
+        'version' (or at all with 'any_version'), None otherwise."""
+        try:
+            with open(self._path("refs", key)) as f:
+                ref = json.load(f)
+            if not any_version and (version is None or ref["version"] != version):
+                return None
+            with open(self._path("objects", ref["object"])) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def put(self, key: str, version, response):
+        content = json.dumps(response)
+        digest = hashlib.sha256(content.encode("utf-8")).hexdigest()
+        object_path = self._path("objects", digest)
+        if not os.path.exists(object_path):
+            self._write(object_path, content)
+        self._write(self._path("refs", key), json.dumps({"version": version, "object": digest}))
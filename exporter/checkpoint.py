@@ -0,0 +1,144 @@
+import json
+import logging
+import os
+
+CHECKPOINT_NAME = "checkpoint.jsonl"
+FAILURES_NAME = "failures.json"
+
+
+class Checkpoint:
+    """Journal of an export in progress, `build/{path}/checkpoint.jsonl`.
+
+    Every exported or failed page is appended as it settles, and so is the
+    cursor of each database query batch once all of its pages (and those of
+    the batches before it) settled. A resumed export restarts the query from
+    the last such cursor, skips the pages already exported and retries the
+    failed ones. The journal is removed once an export completes without
+    failures.
+    """
+
+    def __init__(self, path: str, database_id: str, resume=False, query=None):
+        self.path = path
+        self.database_id = database_id
+        # Cursors are only valid for the query they were returned by
+        self.query = query or {}
+        self.file_path = f"build/{path}/{CHECKPOINT_NAME}"
+        # State recovered from the journal
+        self.cursor = None
+        self.query_done = False
+        self.seen_ids = set()
+        self.done = {}
+        self.failed = {}
+        # Query batches whose pages did not all settle, in query order
+        self.batches = []
+        self.batch_of = {}
+
+        resumed = resume and self.load()
+        os.makedirs(f"build/{path}", exist_ok=True)
+        self.journal = open(self.file_path, "a" if resumed else "w")
+        if not resumed:
+            self.append({"database_id": database_id, "query": self.query})
+
+    def load(self) -> bool:
+        try:
+            with open(self.file_path) as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return False
+        records = []
+        for line in lines:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                # The last line of an interrupted export may be truncated
+                break
+        header = {"database_id": self.database_id, "query": self.query}
+        if not records or records[0] != header:
+            logging.warning(f"Ignoring {self.file_path}, it does not checkpoint this query of {self.database_id}")
+            return False
+
+        for record in records[1:]:
+            if "cursor" in record:
+                self.cursor = record["cursor"]
+                self.query_done = record["cursor"] is None
+                self.seen_ids.update(record["pages"])
+            elif "page" in record:
+                self.done[record["page"]] = record
+                self.failed.pop(record["page"], None)
+            elif "failed" in record:
+                self.failed[record["failed"]] = record
+        logging.info(
+            f"Resuming export of {self.database_id}: {len(self.done)} pages done, "
+            f"{len(self.failed)} to retry"
+        )
+        return True
+
+    def append(self, record: dict):
+        self.journal.write(json.dumps(record) + "\n")
+        self.journal.flush()
+
+    def add_batch(self, next_cursor, page_ids: list, pending_ids: list):
+        """Tracks a query batch, 'pending_ids' being the pages of 'page_ids'
+        queued for export."""
+        batch = {"cursor": next_cursor, "pages": page_ids, "pending": set(pending_ids)}
+        self.batches.append(batch)
+        for page_id in pending_ids:
+            self.batch_of[page_id] = batch
+        self._flush_batches()
+
+    def _flush_batches(self):
+        while self.batches and not self.batches[0]["pending"]:
+            batch = self.batches.pop(0)
+            self.append({"cursor": batch["cursor"], "pages": batch["pages"]})
+
+    def _settle(self, page_id: str):
+        batch = self.batch_of.pop(page_id, None)
+        if batch is not None:
+            batch["pending"].discard(page_id)
+            self._flush_batches()
+
+    def page_done(self, page_id: str, entry: dict, archive_entry=None):
+        record = {"page": page_id, "entry": entry}
+        if archive_entry is not None:
+            record["archive"] = archive_entry
+        self.failed.pop(page_id, None)
+        self.append(record)
+        self._settle(page_id)
+
+    def page_failed(self, row: dict, stage: str, error: Exception):
+        record = {
+            "failed": row["id"],
+            "last_edited_time": row["last_edited_time"],
+            "stage": stage,
+            "error": f"{type(error).__name__}: {error}",
+        }
+        self.failed[row["id"]] = record
+        self.append(record)
+        self._settle(row["id"])
+
+    def retry_rows(self) -> list:
+        """Minimal query rows of the pages that failed in the resumed export.
+
+        Failed pages past the resumed cursor are left to the query.
+        """
+        return [
+            {"id": page_id, "last_edited_time": record["last_edited_time"]}
+            for page_id, record in self.failed.items()
+            if page_id in self.seen_ids
+        ]
+
+    def finish(self):
+        """Closes the journal, writing `failures.json` when pages failed"""
+        self.journal.close()
+        failures_path = f"build/{self.path}/{FAILURES_NAME}"
+        if not self.failed:
+            os.remove(self.file_path)
+            if os.path.exists(failures_path):
+                os.remove(failures_path)
+            return
+        with open(failures_path, "w") as f:
+            json.dump(self.failed, f, indent=2, sort_keys=True)
+        logging.error(
+            f"{len(self.failed)} pages of {self.database_id} failed, see {failures_path}; "
+            f"run again with --resume to retry them"
+        )
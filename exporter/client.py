@@ -0,0 +1,50 @@
+import asyncio
+import time
+
+from notion_client import AsyncClient
+
+from .cache import CacheMissError, ResponseCache, cache_version
+from .metrics import metrics
+from .scheduler import RequestScheduler
+
+
+class ExportClient(AsyncClient):
+    """`AsyncClient` whose every API call goes through a `RequestScheduler`.
+
+    With a 'cache', responses are served from disk while the `cache_version`
+    of the request matches the one they were recorded at. In 'replay' mode
+    every response comes from the cache and no request reaches the network.
+    """
+
+    def __init__(self, scheduler: RequestScheduler, cache: ResponseCache = None, replay=False, **kwargs):
+        super().__init__(**kwargs)
+        self.scheduler = scheduler
+        self.cache = cache
+        self.replay = replay
+
+    async def send(self, path, method, query=None, body=None, auth=None):
+        started_at = time.perf_counter()
+        try:
+            response = await super().request(path, method, query, body, auth)
+        except Exception as error:
+            metrics.record_api_call(path, method, time.perf_counter() - started_at, error)
+            raise
+        metrics.record_api_call(path, method, time.perf_counter() - started_at)
+        return response
+
+    async def request(self, path, method, query=None, body=None, auth=None):
+        if self.cache is None:
+            return await self.scheduler.call(self.send, path, method, query, body, auth)
+
+        key = self.cache.request_key(path, method, query, body)
+        version = cache_version.get()
+        response = await asyncio.to_thread(self.cache.get, key, version, self.replay)
+        if response is not None:
+            metrics.cache_hits += 1
+            return response
+        if self.replay:
+            raise CacheMissError(f"No cached response for {method} {path} (query={query}, body={body})")
+
+        response = await self.scheduler.call(self.send, path, method, query, body, auth)
+        await asyncio.to_thread(self.cache.put, key, version, response)
+        return response
@@ -0,0 +1,247 @@
+import asyncio
+import json
+import logging
+import re
+
+from parser.frontmatter_parser import generate_urls, parse_family_lines, parse_headers, recursive_search
+from .manifest import is_page_fresh
+from .writer import write_atomic
+
+HIERARCHY_NAME = "hierarchy.json"
+# What the manifest entries of a recursive export record about each page
+CRAWL_DETAILS = ("header", "references", "links")
+# Blocks whose children are a page of their own, exported on its own
+SUBPAGE_TYPES = ("child_page",)
+NOTION_LINK = re.compile(r"\[([^\]]*)\]\((https://www\.notion\.so/(?:[\w-]*-)?([0-9a-f]{32})(?:[?#][^)\s]*)?)\)")
+
+
+def link_key(object_id: str) -> str:
+    return object_id.replace("-", "")
+
+
+def block_references(blocks: list) -> dict:
+    """Ids of the pages and databases a block tree links to, through
+    sub-pages, child databases, links to pages and mentions."""
+    pages = set()
+    databases = set()
+    stack = list(blocks)
+    while stack:
+        block = stack.pop()
+        if block["type"] == "child_page":
+            pages.add(block["id"])
+        elif block["type"] == "child_database":
+            databases.add(block["id"])
+        elif block["type"] == "link_to_page":
+            target = block["link_to_page"]
+            if target["type"] == "page_id":
+                pages.add(target["page_id"])
+            elif target["type"] == "database_id":
+                databases.add(target["database_id"])
+        stack.extend(block.get("children", []))
+    for mention in recursive_search("mention", {"results": blocks}):
+        if mention["type"] == "page":
+            pages.add(mention["page"]["id"])
+        elif mention["type"] == "database":
+            databases.add(mention["database"]["id"])
+    return {"pages": sorted(pages), "databases": sorted(databases)}
+
+
+def page_header(page: dict) -> dict:
+    """The parts of a page or database object `parse_headers` reads"""
+    header = {key: page.get(key) for key in ("object", "id", "parent", "last_edited_time", "cover", "icon")}
+    if page["object"] == "database":
+        header["title"] = page.get("title", [])
+    else:
+        header["properties"] = {
+            name: prop for name, prop in page.get("properties", {}).items()
+            if prop["type"] == "title" or name == "Date"
+        }
+    return header
+
+
+class PageCrawl:
+    """The pages and databases reachable from an exported database.
+
+    Every object is visited once however many pages link to it. Pages and
+    databases found while fetching are handed back to the query stage
+    through 'discovered', which ends with `DONE` once nothing is in flight.
+    """
+
+    def __init__(self, root_id: str, path: str, manifest: dict, incremental=False, done=()):
+        self.root_id = root_id
+        self.path = path
+        self.manifest = manifest
+        self.incremental = incremental
+        # Pages a resumed export already exported
+        self.done = set(done)
+        self.visited = {root_id}
+        self.headers = {}
+        self.references = {}
+        self.discovered = asyncio.Queue()
+        self.in_flight = 0
+        self.querying = True
+        self.finished = False
+
+    def reuse_entry(self, row: dict, unchanged=False) -> bool:
+        """Whether a page needs no export, being 'unchanged', already done or
+        fresh in an incremental export, and its manifest entry recorded what
+        it links to.
+        Those links are then crawled from the entry."""
+        entry = self.manifest["pages"].get(row["id"])
+        if entry is None or "references" not in entry:
+            return False
+        if not (unchanged or row["id"] in self.done or self.incremental and is_page_fresh(self.manifest, self.path, row)):
+            return False
+        self.record(row["id"], entry["header"], entry["references"])
+        return True
+
+    def record(self, object_id: str, header: dict, references: dict):
+        self.headers[object_id] = header
+        self.references[object_id] = references
+        for page_id in references["pages"]:
+            if page_id not in self.visited:
+                self.visited.add(page_id)
+                self.discovered.put_nowait({"id": page_id, "last_edited_time": None, "linked": True})
+        for database_id in references["databases"]:
+            if database_id not in self.visited:
+                self.visited.add(database_id)
+                self.discovered.put_nowait({"database": database_id})
+
+    def started(self):
+        self.in_flight += 1
+
+    def settled(self):
+        self.in_flight -= 1
+        self.check_done()
+
+    def query_finished(self):
+        self.querying = False
+        self.check_done()
+
+    def check_done(self):
+        if not (self.finished or self.querying or self.in_flight or not self.discovered.empty()):
+            self.finished = True
+            self.discovered.put_nowait(None)
+
+    def page_links(self, page_id: str, links: dict) -> dict:
+        """The entries of 'links' a page needs"""
+        references = self.references.get(page_id, {"pages": [], "databases": []})
+        return {
+            link_key(object_id): links[link_key(object_id)]
+            for object_id in references["pages"] + references["databases"]
+            if link_key(object_id) in links
+        }
+
+    def choose_parents(self) -> dict:
+        """The parent of every crawled object in the exported hierarchy.
+
+        Objects keep their Notion parent when it was crawled too; the others
+        (pages linked from elsewhere in the workspace, pages inside blocks)
+        hang under the closest page linking to them.
+        """
+        depths = {self.root_id: 0}
+        referrers = {}
+        level = [self.root_id]
+        while level:
+            next_level = []
+            for object_id in sorted(level):
+                references = self.references.get(object_id, {"pages": [], "databases": []})
+                for child_id in references["pages"] + references["databases"]:
+                    if child_id not in self.headers:
+                        continue
+                    referrers.setdefault(child_id, []).append(object_id)
+                    if child_id not in depths:
+                        depths[child_id] = depths[object_id] + 1
+                        next_level.append(child_id)
+            level = next_level
+
+        parents = {self.root_id: None}
+        for object_id in self.headers:
+            parent = self.headers[object_id]["parent"] or {}
+            parent_id = parent.get(parent.get("type"))
+            if object_id != self.root_id and parent_id in self.headers and parent.get("type") != "block_id":
+                parents[object_id] = parent_id
+
+        def is_ancestor(object_id, of):
+            while of is not None:
+                if of == object_id:
+                    return True
+                of = parents.get(of)
+            return False
+
+        for object_id in sorted(depths, key=lambda object_id: (depths[object_id], object_id)):
+            if object_id in parents:
+                continue
+            candidates = sorted(referrers.get(object_id, []), key=lambda referrer: (depths[referrer], referrer))
+            parents[object_id] = next(
+                (referrer for referrer in candidates if not is_ancestor(object_id, referrer)), self.root_id,
+            )
+        return parents
+
+    def build_hierarchy(self, site_url: str = "") -> dict:
+        """Structures the crawl with `parse_headers`, `parse_family_lines` and
+        `generate_urls`, returning the structured pages by id."""
+        parents = self.choose_parents()
+
+        def depth(object_id):
+            count = 0
+            while (object_id := parents.get(object_id)) is not None:
+                count += 1
+            return count
+
+        raw_notion = {}
+        # parse_headers links children to parents it has already seen
+        for object_id in sorted(parents, key=lambda object_id: (depth(object_id), object_id)):
+            header = dict(self.headers[object_id])
+            parent_id = parents[object_id]
+            if parent_id is None:
+                header["parent"] = {"type": "workspace", "workspace": True}
+            elif self.headers[parent_id]["object"] == "database":
+                header["parent"] = {"type": "database_id", "database_id": parent_id}
+            else:
+                header["parent"] = {"type": "page_id", "page_id": parent_id}
+                if header["object"] == "page":
+                    # Pages outside of a database have their title in 'title'
+                    titles = [prop for prop in header["properties"].values() if prop["type"] == "title"]
+                    header["properties"] = {"title": titles[0] if titles else {"type": "title", "title": []}}
+            raw_notion[object_id] = header
+
+        structured_notion = {"pages": parse_headers(raw_notion), "urls": [], "root_page_id": self.root_id}
+        parse_family_lines(structured_notion)
+        generate_urls(self.root_id, structured_notion, {"build_locally": False, "site_url": site_url})
+        return structured_notion["pages"]
+
+    def link_targets(self, hierarchy: dict, site_url=None) -> dict:
+        """Where links to crawled objects point: the exported markdown of a
+        page relative to another page, or with a 'site_url' its site URL.
+        Keyed by `link_key`, with the title to show for bare links."""
+        links = {}
+        for object_id, page in hierarchy.items():
+            if site_url:
+                target = page.get("url")
+            else:
+                entry = self.manifest["pages"].get(object_id)
+                target = f"../{object_id}/{entry['slug']}.md" if entry else None
+            if target:
+                links[link_key(object_id)] = [page["title"] or target, target]
+        return links
+
+
+def rewrite_links(page_md: str, links: dict) -> str:
+    """Points the notion.so links of 'page_md' to crawled pages at their
+    `PageCrawl.link_targets`."""
+    def rewrite(match):
+        text, url, key = match.groups()
+        if key not in links:
+            return match.group(0)
+        title, target = links[key]
+        return f"[{title if text == url else text}]({target})"
+    return NOTION_LINK.sub(rewrite, page_md)
+
+
+def save_hierarchy(path: str, hierarchy: dict):
+    write_atomic(
+        f"build/{path}/{HIERARCHY_NAME}",
+        json.dumps(hierarchy, indent=2, sort_keys=True, default=str).encode("utf-8"),
+    )
+    logging.info(f"Wrote the hierarchy of {len(hierarchy)} pages and databases to build/{path}/{HIERARCHY_NAME}")
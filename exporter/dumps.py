@@ -0,0 +1,260 @@
+import gzip
+import json
+import os
+import shutil
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from .writer import StreamedOutput, write_atomic
+
+DUMP_FORMATS = ("pretty", "minified", "gzip", "zstd", "jsonl", "none")
+# File name suffix of the per-page dump formats, in the order they are read back
+DUMP_SUFFIXES = {
+    "pretty": ".json",
+    "minified": ".json",
+    "gzip": ".json.gz",
+    "zstd": ".json.zst",
+}
+ARCHIVE_NAME = "dumps.jsonl"
+ARCHIVE_INDEX_NAME = "dumps.index.json"
+
+
+def encode_json(obj, pretty=False) -> bytes:
+    """Serializes 'obj' to UTF-8 JSON, with orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if pretty else 0)
+    if pretty:
+        return json.dumps(obj, indent=2, ensure_ascii=False).encode("utf-8")
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def decode_json(data: bytes):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def check_dump_format(dump_format: str):
+    if dump_format not in DUMP_FORMATS:
+        raise ValueError(f"dump format must be one of {', '.join(DUMP_FORMATS)}")
+    if dump_format == "zstd" and zstandard is None:
+        raise ValueError("the zstd dump format requires the zstandard package")
+
+
+def block_listing(results: list) -> dict:
+    """The dumped blocks of a page: a `blocks.children.list` response listing
+    every top-level block, each with its children expanded"""
+    return {"object": "list", "results": results, "next_cursor": None, "has_more": False, "type": "block", "block": {}}
+
+
+def dump_page(page_id: str, page: dict, blocks: dict, dump_format="pretty"):
+    """Serializes the raw page and blocks.
+
+    Returns the dump files of the page (output path → bytes), or for the
+    jsonl format the archive record of the page.
+    """
+    if dump_format == "none":
+        return {}
+    if dump_format == "jsonl":
+        return encode_json({"id": page_id, "page": page, "blocks": blocks}) + b"\n"
+
+    page_data = encode_json(page, pretty=dump_format == "pretty")
+    block_data = encode_json(blocks, pretty=dump_format == "pretty")
+    if dump_format == "gzip":
+        # mtime=0 keeps the output identical for identical content
+        page_data = gzip.compress(page_data, mtime=0)
+        block_data = gzip.compress(block_data, mtime=0)
+    elif dump_format == "zstd":
+        compressor = zstandard.ZstdCompressor()
+        page_data = compressor.compress(page_data)
+        block_data = compressor.compress(block_data)
+
+    suffix = DUMP_SUFFIXES[dump_format]
+    return {f"{page_id}/page{suffix}": page_data, f"{page_id}/block{suffix}": block_data}
+
+
+class DumpStream:
+    """Writes the dumps of a page block by block as `dump_page` would, so the
+    blocks of a page are never serialized at once.
+
+    Per-page dumps end up in 'streamed' (output path → `StreamedOutput`) and
+    'files', the jsonl record in 'record'. The JSON is the same as
+    `dump_page`'s; compressed dumps are compressed as one stream.
+    """
+
+    def __init__(self, root: str, page_id: str, page: dict, dump_format="pretty"):
+        self.pretty = dump_format == "pretty"
+        self.count = 0
+        self.files = {}
+        self.streamed = {}
+        self.record = None
+        self.blocks = None
+        if dump_format == "none":
+            return
+
+        if dump_format == "jsonl":
+            self.record = self.blocks = StreamedOutput(f"{root}/{page_id}.jsonl")
+            self.blocks.write(b'{"id":' + encode_json(page_id) + b',"page":' + encode_json(page) + b',"blocks":')
+        else:
+            suffix = DUMP_SUFFIXES[dump_format]
+            self.files[f"{page_id}/page{suffix}"] = dump_page(page_id, page, {}, dump_format)[f"{page_id}/page{suffix}"]
+            output = self.streamed[f"{page_id}/block{suffix}"] = StreamedOutput(f"{root}/{page_id}/block{suffix}")
+            if dump_format == "gzip":
+                self.blocks = gzip.GzipFile(filename="", mode="wb", fileobj=output, mtime=0)
+            elif dump_format == "zstd":
+                self.blocks = zstandard.ZstdCompressor().stream_writer(output, closefd=False)
+            else:
+                self.blocks = output
+        # The listing around the results, as `encode_json` lays it out
+        head, self.tail = encode_json(block_listing([]), pretty=self.pretty).split(b"[]", 1)
+        self.blocks.write(head + b"[")
+
+    def add(self, block: dict):
+        if self.blocks is None:
+            return
+        data = encode_json(block, pretty=self.pretty)
+        if self.pretty:
+            # Nested two levels deep, in the list of results
+            data = b"\n".join(b"    " + line for line in data.split(b"\n"))
+            data = (b",\n" if self.count else b"\n") + data
+        elif self.count:
+            data = b"," + data
+        self.blocks.write(data)
+        self.count += 1
+
+    def close(self):
+        if self.blocks is None:
+            return
+        self.blocks.write((b"\n  ]" if self.pretty and self.count else b"]") + self.tail)
+        if self.record is not None:
+            self.blocks.write(b"}\n")
+            self.record.close()
+        elif not isinstance(self.blocks, StreamedOutput):
+            # Flushes the end of the compressed stream
+            self.blocks.close()
+
+    def discard(self):
+        for output in list(self.streamed.values()) + [self.record]:
+            if output is not None:
+                output.discard()
+
+
+def _read_dump_file(file_path: str):
+    with open(file_path, "rb") as f:
+        data = f.read()
+    if file_path.endswith(".gz"):
+        data = gzip.decompress(data)
+    elif file_path.endswith(".zst"):
+        # Streamed dumps do not record their size in the frame header
+        data = zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    return decode_json(data)
+
+
+def find_page_dump(path: str, page_id: str):
+    """Returns the suffix of the per-page dumps of a page, if any"""
+    for suffix in dict.fromkeys(DUMP_SUFFIXES.values()):
+        if os.path.exists(f"build/{path}/{page_id}/page{suffix}") \
+                and os.path.exists(f"build/{path}/{page_id}/block{suffix}"):
+            return suffix
+    return None
+
+
+def load_page_dump(path: str, page_id: str, archive_entry=None) -> tuple:
+    """Reads back the raw page and blocks of a page, from its dump files or
+    from 'archive_entry' (its `DumpArchive` index entry)."""
+    suffix = find_page_dump(path, page_id)
+    if suffix is not None:
+        return (
+            _read_dump_file(f"build/{path}/{page_id}/page{suffix}"),
+            _read_dump_file(f"build/{path}/{page_id}/block{suffix}"),
+        )
+    if archive_entry is not None:
+        record = DumpArchive.read_record(path, archive_entry)
+        return record["page"], record["blocks"]
+    raise FileNotFoundError(f"No dump of page {page_id} in build/{path}")
+
+
+class DumpArchive:
+    """One NDJSON archive of raw pages per database, `build/{path}/dumps.jsonl`.
+
+    Records are appended, and `dumps.index.json` maps each page id to the
+    offset and length of its latest record. The archive is compacted once
+    most of it is made of superseded records.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.archive_path = f"build/{path}/{ARCHIVE_NAME}"
+        self.index_path = f"build/{path}/{ARCHIVE_INDEX_NAME}"
+        self.index = self.load_index(path)
+
+    @staticmethod
+    def load_index(path: str) -> dict:
+        try:
+            with open(f"build/{path}/{ARCHIVE_INDEX_NAME}") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    @staticmethod
+    def read_bytes(path: str, entry: dict) -> bytes:
+        with open(f"build/{path}/{ARCHIVE_NAME}", "rb") as f:
+            f.seek(entry["offset"])
+            return f.read(entry["length"])
+
+    @staticmethod
+    def read_record(path: str, entry: dict) -> dict:
+        return decode_json(DumpArchive.read_bytes(path, entry))
+
+    def append(self, page_id: str, record: bytes):
+        os.makedirs(os.path.dirname(self.archive_path), exist_ok=True)
+        with open(self.archive_path, "ab") as f:
+            offset = f.tell()
+            f.write(record)
+        self.index[page_id] = {"offset": offset, "length": len(record)}
+
+    def append_file(self, page_id: str, file_path: str):
+        """Appends the record written to 'file_path', removing the file"""
+        os.makedirs(os.path.dirname(self.archive_path), exist_ok=True)
+        with open(self.archive_path, "ab") as f, open(file_path, "rb") as record:
+            offset = f.tell()
+            shutil.copyfileobj(record, f)
+            length = f.tell() - offset
+        os.remove(file_path)
+        self.index[page_id] = {"offset": offset, "length": length}
+
+    def remove(self, page_id: str):
+        self.index.pop(page_id, None)
+
+    def save(self):
+        if self.index or os.path.exists(self.index_path):
+            os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+            write_atomic(self.index_path, json.dumps(self.index, indent=2, sort_keys=True).encode("utf-8"))
+
+    def compact(self):
+        """Rewrites the archive with only the latest record of each page when
+        superseded records take more than half of it."""
+        if not os.path.exists(self.archive_path):
+            return
+        live = sum(entry["length"] for entry in self.index.values())
+        if live * 2 >= os.path.getsize(self.archive_path):
+            return
+
+        tmp_path = f"{self.archive_path}.{os.getpid()}.tmp"
+        index = {}
+        with open(self.archive_path, "rb") as source, open(tmp_path, "wb") as target:
+            for page_id, entry in sorted(self.index.items(), key=lambda item: item[1]["offset"]):
+                source.seek(entry["offset"])
+                index[page_id] = {"offset": target.tell(), "length": entry["length"]}
+                target.write(source.read(entry["length"]))
+        os.replace(tmp_path, self.archive_path)
+        self.index = index
+        self.save()
@@ -0,0 +1,102 @@
+import re
+from datetime import date, timedelta
+
+import dateutil.parser as dt_parser
+
+TIMESTAMPS = ("created_time", "last_edited_time")
+SORT_DIRECTIONS = ("ascending", "descending")
+
+
+def parse_condition(spec: str) -> tuple:
+    """'Status=Published' → ('Status', 'Published')"""
+    name, sep, value = spec.partition("=")
+    if not sep or not name.strip():
+        raise ValueError(f"filters are written 'Property=value', got '{spec}'")
+    return name.strip(), value.strip()
+
+
+def parse_since(spec: str) -> str:
+    """An ISO 8601 date or time, or 'Nd' for N days ago (as a date, so that
+    the query stays the same for a whole day and can be resumed)."""
+    if re.fullmatch(r"\d+d", spec):
+        return (date.today() - timedelta(days=int(spec[:-1]))).isoformat()
+    try:
+        # Unlike datetime.fromisoformat before Python 3.11, takes a "Z" suffix
+        dt_parser.isoparse(spec)
+    except ValueError:
+        raise ValueError(f"expected an ISO 8601 date or a number of days like '7d', got '{spec}'")
+    return spec
+
+
+def property_condition(name: str, prop: dict, value: str) -> dict:
+    """The filter matching pages whose property 'name' equals 'value'"""
+    kind = prop["type"]
+    if kind in ("select", "status", "title", "rich_text", "url", "email", "phone_number", "date") + TIMESTAMPS:
+        return {"property": name, kind: {"equals": value}}
+    if kind in ("multi_select", "people", "relation"):
+        return {"property": name, kind: {"contains": value}}
+    if kind == "number":
+        return {"property": name, kind: {"equals": float(value)}}
+    if kind == "checkbox":
+        return {"property": name, kind: {"equals": value.lower() in ("true", "yes", "1")}}
+    raise ValueError(f"cannot filter on the {kind} property {name}")
+
+
+def find_property(schema: dict, name: str) -> dict:
+    if name not in schema:
+        raise ValueError(f"no property {name}, the database has {', '.join(sorted(schema))}")
+    return schema[name]
+
+
+def status_property(schema: dict) -> str:
+    """The status property of a database, or its 'Status' select"""
+    for name, prop in schema.items():
+        if prop["type"] == "status":
+            return name
+    if schema.get("Status", {}).get("type") == "select":
+        return "Status"
+    raise ValueError("the database has no status property")
+
+
+def parse_sort(schema: dict, spec: str) -> dict:
+    """'Date', 'Date:descending' or 'last_edited_time:descending'"""
+    name, _, direction = spec.partition(":")
+    direction = direction or "ascending"
+    if direction not in SORT_DIRECTIONS:
+        raise ValueError(f"sort direction must be one of {', '.join(SORT_DIRECTIONS)}, got '{direction}'")
+    if name in TIMESTAMPS and name not in schema:
+        return {"timestamp": name, "direction": direction}
+    find_property(schema, name)
+    return {"property": name, "direction": direction}
+
+
+async def database_query(notion, database_id, where=(), edited_after=None, statuses=(), sorts=(), properties=()) -> dict:
+    """The `filter`, `sorts` and `filter_properties` arguments of the
+    `databases.query` of an export.
+
+    'where' holds 'Property=value' equality conditions, all of which must
+    hold, 'edited_after' restricts the query to pages edited since then and
+    'statuses' to pages in one of those statuses. 'properties' limits the
+    properties the API returns; the title is always kept.
+    """
+    schema = (await notion.databases.retrieve(database_id))["properties"]
+    conditions = []
+    for name, value in map(parse_condition, where):
+        conditions.append(property_condition(name, find_property(schema, name), value))
+    if edited_after is not None:
+        conditions.append({"timestamp": "last_edited_time", "last_edited_time": {"after": parse_since(edited_after)}})
+    if statuses:
+        name = status_property(schema)
+        status_conditions = [property_condition(name, schema[name], status) for status in statuses]
+        conditions.append(status_conditions[0] if len(status_conditions) == 1 else {"or": status_conditions})
+
+    query = {}
+    if conditions:
+        query["filter"] = conditions[0] if len(conditions) == 1 else {"and": conditions}
+    if sorts:
+        query["sorts"] = [parse_sort(schema, spec) for spec in sorts]
+    if properties:
+        titles = [name for name, prop in schema.items() if prop["type"] == "title"]
+        names = dict.fromkeys(titles + list(properties))
+        query["filter_properties"] = [find_property(schema, name)["id"] for name in names]
+    return query
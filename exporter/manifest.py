@@ -0,0 +1,117 @@
+import hashlib
+import json
+import os
+
+MANIFEST_NAME = "manifest.json"
+# In-memory index of the pages claiming each output, never saved
+OWNERS_KEY = "_owners"
+
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def manifest_path(path: str) -> str:
+    return f"build/{path}/{MANIFEST_NAME}"
+
+
+def load_manifest(path: str) -> dict:
+    """Loads the sync manifest of 'build/{path}', or an empty one"""
+    try:
+        with open(manifest_path(path)) as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        manifest = {}
+    manifest.setdefault("pages", {})
+    manifest[OWNERS_KEY] = _index_owners(manifest["pages"])
+    return manifest
+
+
+def save_manifest(path: str, manifest: dict):
+    os.makedirs(f"build/{path}", exist_ok=True)
+    tmp_path = manifest_path(path) + ".tmp"
+    saved = {key: value for key, value in manifest.items() if key != OWNERS_KEY}
+    with open(tmp_path, "w") as f:
+        json.dump(saved, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path(path))
+
+
+def is_page_fresh(manifest: dict, path: str, page: dict) -> bool:
+    """A page is fresh when its last_edited_time did not move since the last
+    export and every output we recorded for it is still on disk."""
+    entry = manifest["pages"].get(page["id"])
+    if entry is None or entry["last_edited_time"] != page["last_edited_time"]:
+        return False
+    return all(os.path.exists(f"build/{path}/{output}") for output in entry["outputs"])
+
+
+def _index_owners(pages: dict) -> dict:
+    owners = {}
+    for page_id, entry in pages.items():
+        for output in entry["outputs"]:
+            owners.setdefault(output, set()).add(page_id)
+    return owners
+
+
+def _owners(manifest: dict) -> dict:
+    """Output → ids of the pages claiming it, built on first use for
+    manifests that were not loaded by `load_manifest`"""
+    if OWNERS_KEY not in manifest:
+        manifest[OWNERS_KEY] = _index_owners(manifest["pages"])
+    return manifest[OWNERS_KEY]
+
+
+def _release_outputs(manifest: dict, page_id: str, outputs) -> set:
+    """Drops the claims of 'page_id' on 'outputs', returning those that
+    another page still claims"""
+    owners = _owners(manifest)
+    claimed = set()
+    for output in outputs:
+        output_owners = owners.get(output, set())
+        output_owners.discard(page_id)
+        if output_owners:
+            claimed.add(output)
+        else:
+            owners.pop(output, None)
+    return claimed
+
+
+def _remove_outputs(path: str, outputs, claimed: set):
+    for output in outputs:
+        if output in claimed:
+            continue
+        output_path = f"build/{path}/{output}"
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        output_dir = os.path.dirname(output_path)
+        if os.path.isdir(output_dir) and not os.listdir(output_dir):
+            os.rmdir(output_dir)
+
+
+def record_page(manifest: dict, path: str, page_id: str, last_edited_time: str, slug: str, outputs: dict, **details):
+    """Records a freshly exported page, removing outputs it no longer produces
+    (e.g. the old `_markdown/{slug}.md` of a renamed page). 'details' are
+    stored with the entry."""
+    previous = manifest["pages"].get(page_id)
+    if previous is not None:
+        stale = set(previous["outputs"]) - set(outputs)
+        if stale:
+            _remove_outputs(path, stale, _release_outputs(manifest, page_id, stale))
+    owners = _owners(manifest)
+    for output in outputs:
+        owners.setdefault(output, set()).add(page_id)
+    manifest["pages"][page_id] = {
+        "last_edited_time": last_edited_time,
+        "slug": slug,
+        "outputs": outputs,
+        **details,
+    }
+
+
+def prune_pages(manifest: dict, path: str, seen_ids: set) -> list:
+    """Deletes the outputs of every page that vanished from the database query"""
+    vanished = [page_id for page_id in manifest["pages"] if page_id not in seen_ids]
+    for page_id in vanished:
+        entry = manifest["pages"].pop(page_id)
+        _remove_outputs(path, entry["outputs"], _release_outputs(manifest, page_id, entry["outputs"]))
+    return vanished
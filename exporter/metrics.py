@@ -0,0 +1,202 @@
+import cProfile
+import json
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+
+def endpoint_of(path: str, method: str) -> str:
+    """'blocks/{id}/children' style name of an API path"""
+    segments = path.strip("/").split("/")
+    if len(segments) > 1:
+        segments[1] = "{id}"
+    return f"{method} {'/'.join(segments)}"
+
+
+def percentile(values: list, ratio: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(ratio * len(values)))]
+
+
+class Metrics:
+    """Counters and timers of an export run"""
+
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self.stage_seconds = defaultdict(float)
+        self.stage_counts = Counter()
+        self.api_calls = Counter()
+        self.api_seconds = defaultdict(float)
+        self.api_errors = Counter()
+        self.cache_hits = 0
+        self.throttled = 0
+        self.retries = 0
+        self.files_written = 0
+        self.files_skipped = 0
+        self.bytes_written = 0
+        self.page_started_at = {}
+        self.page_seconds = []
+        self.pages_failed = 0
+
+    def record_stage(self, stage: str, seconds: float):
+        self.stage_seconds[stage] += seconds
+        self.stage_counts[stage] += 1
+
+    async def timed(self, stage: str, awaitable):
+        started_at = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            self.record_stage(stage, time.perf_counter() - started_at)
+
+    @contextmanager
+    def timer(self, stage: str):
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_stage(stage, time.perf_counter() - started_at)
+
+    def record_api_call(self, path: str, method: str, seconds: float, error=None):
+        endpoint = endpoint_of(path, method)
+        self.api_calls[endpoint] += 1
+        self.api_seconds[endpoint] += seconds
+        if error is not None:
+            self.api_errors[endpoint] += 1
+
+    def record_write(self, result: dict):
+        self.files_written += len(result["written"])
+        self.files_skipped += len(result["outputs"]) - len(result["written"])
+        self.bytes_written += result["bytes"]
+
+    def page_started(self, page_id: str):
+        self.page_started_at[page_id] = time.monotonic()
+
+    def page_finished(self, page_id: str):
+        started_at = self.page_started_at.pop(page_id, None)
+        if started_at is not None:
+            self.page_seconds.append(time.monotonic() - started_at)
+
+    def page_failed(self, page_id: str):
+        self.page_started_at.pop(page_id, None)
+        self.pages_failed += 1
+
+    def to_dict(self) -> dict:
+        return {
+            "wall_seconds": time.monotonic() - self.started_at,
+            "stages": {
+                stage: {"count": self.stage_counts[stage], "seconds": seconds}
+                for stage, seconds in sorted(self.stage_seconds.items())
+            },
+            "api": {
+                endpoint: {
+                    "calls": calls,
+                    "errors": self.api_errors[endpoint],
+                    "seconds": self.api_seconds[endpoint],
+                }
+                for endpoint, calls in sorted(self.api_calls.items())
+            },
+            "cache_hits": self.cache_hits,
+            "throttled": self.throttled,
+            "retries": self.retries,
+            "files_written": self.files_written,
+            "files_skipped": self.files_skipped,
+            "bytes_written": self.bytes_written,
+            "pages": {
+                "count": len(self.page_seconds),
+                "failed": self.pages_failed,
+                "p50_seconds": percentile(self.page_seconds, 0.5),
+                "p99_seconds": percentile(self.page_seconds, 0.99),
+                "max_seconds": max(self.page_seconds, default=0.0),
+            },
+        }
+
+    def summary(self) -> str:
+        report = self.to_dict()
+        lines = [f"{'stage':<32} {'count':>8} {'total s':>10} {'mean ms':>10}"]
+        for stage, stats in report["stages"].items():
+            mean = stats["seconds"] / stats["count"] * 1000 if stats["count"] else 0
+            lines.append(f"{stage:<32} {stats['count']:>8} {stats['seconds']:>10.2f} {mean:>10.1f}")
+        lines.append("")
+        lines.append(f"{'api endpoint':<32} {'calls':>8} {'errors':>10} {'mean ms':>10}")
+        for endpoint, stats in report["api"].items():
+            mean = stats["seconds"] / stats["calls"] * 1000 if stats["calls"] else 0
+            lines.append(f"{endpoint:<32} {stats['calls']:>8} {stats['errors']:>10} {mean:>10.1f}")
+        lines.append("")
+        pages = report["pages"]
+        lines.append(
+            f"pages: {pages['count']} in {report['wall_seconds']:.1f}s ({pages['failed']} failed), "
+            f"p50 {pages['p50_seconds']:.2f}s, p99 {pages['p99_seconds']:.2f}s, max {pages['max_seconds']:.2f}s"
+        )
+        lines.append(
+            f"cache hits: {report['cache_hits']}, throttled: {report['throttled']}, retries: {report['retries']}"
+        )
+        lines.append(
+            f"files written: {report['files_written']} ({report['bytes_written']} bytes), "
+            f"unchanged: {report['files_skipped']}"
+        )
+        return "\n".join(lines)
+
+    def to_prometheus(self) -> str:
+        """The report in the Prometheus textfile collector format"""
+        report = self.to_dict()
+        lines = [
+            "# TYPE notion_export_wall_seconds gauge",
+            f"notion_export_wall_seconds {report['wall_seconds']}",
+            "# TYPE notion_export_stage_seconds_total counter",
+        ]
+        for stage, stats in report["stages"].items():
+            lines.append(f'notion_export_stage_seconds_total{{stage="{stage}"}} {stats["seconds"]}')
+        lines.append("# TYPE notion_export_stage_runs_total counter")
+        for stage, stats in report["stages"].items():
+            lines.append(f'notion_export_stage_runs_total{{stage="{stage}"}} {stats["count"]}')
+        for name in ("calls", "errors", "seconds"):
+            lines.append(f"# TYPE notion_export_api_{name}_total counter")
+            for endpoint, stats in report["api"].items():
+                lines.append(f'notion_export_api_{name}_total{{endpoint="{endpoint}"}} {stats[name]}')
+        for name in ("cache_hits", "throttled", "retries", "files_written", "files_skipped", "bytes_written"):
+            lines.append(f"# TYPE notion_export_{name}_total counter")
+            lines.append(f"notion_export_{name}_total {report[name]}")
+        lines.append("# TYPE notion_export_pages_failed_total counter")
+        lines.append(f"notion_export_pages_failed_total {self.pages_failed}")
+        lines.append("# TYPE notion_export_page_seconds summary")
+        for quantile in ("0.5", "0.99"):
+            value = percentile(self.page_seconds, float(quantile))
+            lines.append(f'notion_export_page_seconds{{quantile="{quantile}"}} {value}')
+        lines.append(f"notion_export_page_seconds_sum {sum(self.page_seconds)}")
+        lines.append(f"notion_export_page_seconds_count {len(self.page_seconds)}")
+        return "\n".join(lines) + "\n"
+
+    def write_report(self, file_path: str):
+        """Writes a Prometheus textfile for '.prom' paths, JSON otherwise"""
+        if file_path.endswith(".prom"):
+            content = self.to_prometheus()
+        else:
+            content = json.dumps(self.to_dict(), indent=2)
+        tmp_path = f"{file_path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(content)
+        os.replace(tmp_path, file_path)
+
+
+metrics = Metrics()
+
+_profilers = threading.local()
+
+
+def profile_call(profile_dir: str, function, *args):
+    """Runs 'function' under this thread's cProfile profiler, and dumps the
+    accumulated stats to 'profile_dir/render-{pid}-{thread}.prof'."""
+    profiler = getattr(_profilers, "profiler", None)
+    if profiler is None:
+        profiler = _profilers.profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        return function(*args)
+    finally:
+        profiler.disable()
+        profiler.dump_stats(os.path.join(profile_dir, f"render-{os.getpid()}-{threading.get_ident()}.prof"))
@@ -0,0 +1,574 @@
+import asyncio
+import logging
+import time
+
+import aiohttp
+from notion_client import APIErrorCode, APIResponseError
+
+from parser.frontmatter_parser import parse_frontmatter
+from parser.markdown_parser import parse_markdown
+from parser.notion_parser import fetch_page_blocks, paginate, paginate_responses, stream_page_blocks
+from parser.utils import slugify
+from .assets import AssetStore, asset_urls
+from .cache import cache_version
+from .checkpoint import Checkpoint
+from .crawl import SUBPAGE_TYPES, PageCrawl, block_references, page_header, rewrite_links, save_hierarchy
+from .dumps import DumpArchive, block_listing, dump_page, load_page_dump
+from .filters import database_query
+from .metrics import metrics, profile_call
+from .manifest import (
+    is_page_fresh,
+    load_manifest,
+    prune_pages,
+    record_page,
+    save_manifest,
+)
+from .scheduler import scheduler_share
+from .stream import PageStream
+from .writer import OutputWriter
+
+# Marks the end of a stage's input
+DONE = None
+MANIFEST_SAVE_INTERVAL = 100
+
+
+def page_title(page_id: str, page: dict) -> str:
+    """The slugified title of a page, or its id when the title is empty"""
+    title = next((prop["title"] for prop in page["properties"].values() if prop["type"] == "title"), [])
+    return (title and slugify(title[0]["plain_text"])) or page_id
+
+
+def render_markdown(page_id: str, page: dict, blocks: dict, links=None) -> tuple:
+    """Returns the slugified title and the markdown of a page, its links to
+    crawled pages pointing at their 'links' targets (see `exporter.crawl`)."""
+    page = parse_frontmatter(page)
+    title = page_title(page_id, page)
+    page_md = parse_markdown(page_id, blocks, page["frontmatter"])
+    if links:
+        page_md = rewrite_links(page_md, links)
+    return title, page_md
+
+
+def render_page(page_id: str, page: dict, blocks: dict, dump_format="pretty", links=None, assets=False) -> dict:
+    started_at = time.perf_counter()
+    title, page_md = render_markdown(page_id, page, blocks, links)
+    rendered_at = time.perf_counter()
+    dumps = dump_page(page_id, page, blocks, dump_format)
+    return {
+        "title": title,
+        "markdown": page_md,
+        "dumps": dumps,
+        "assets": asset_urls(page, blocks) if assets else [],
+        # Measured here since rendering may run in another process
+        "timings": {
+            "render.markdown": rendered_at - started_at,
+            "render.dumps": time.perf_counter() - rendered_at,
+        },
+    }
+
+
+def page_outputs(page_id: str, rendered: dict) -> tuple:
+    """The files of a rendered page, and the outputs that are copies of them"""
+    title = rendered["title"]
+    # Streamed pages only leave the small dump files to write
+    files = {f"{page_id}/{title}.md": rendered["markdown"]} if "markdown" in rendered else {}
+    if isinstance(rendered.get("dumps"), dict):
+        files.update(rendered["dumps"])
+    files.update(rendered.get("files", {}))
+    links = {f"_markdown/{title}.md": f"{page_id}/{title}.md"}
+    return files, links
+
+
+async def listed_pages(rows: list):
+    """'rows' as the only batch of a database query"""
+    yield {"results": rows, "next_cursor": None}
+
+
+async def query_pages(
+    notion, path, database_id, fetch_queue, manifest, seen_ids, checkpoint, incremental=False, rows=None, query=None,
+    crawl=None,
+):
+    """Pages through the database query, queueing every page to (re)download.
+
+    The query keeps paginating ahead of the fetch workers until the queue is
+    full, so a slow page never holds back the next batch. A resumed export
+    first retries the pages that failed, then queries from its checkpoint.
+    Given 'rows', those pages are exported instead of querying the database.
+    'query' holds the filter, sorts and filter_properties of the query.
+    With a 'crawl', the pages and databases found while fetching are queued
+    after the query, until the crawl runs out of them.
+    """
+    async def queue_page(row):
+        if crawl is not None:
+            crawl.started()
+        await fetch_queue.put(row)
+
+    seen_ids.update(checkpoint.seen_ids)
+    if crawl is not None:
+        crawl.visited.update(checkpoint.seen_ids)
+        for page_id in sorted(checkpoint.seen_ids & checkpoint.done.keys()):
+            crawl.reuse_entry({"id": page_id}, unchanged=True)
+    for row in checkpoint.retry_rows():
+        await queue_page(row)
+
+    if not checkpoint.query_done:
+        if rows is not None:
+            responses = listed_pages(rows)
+        else:
+            responses = paginate_responses(
+                notion.databases.query, start_cursor=checkpoint.cursor, database_id=database_id, **(query or {}),
+            )
+        async for response in responses:
+            rows = []
+            for row in response["results"]:
+                seen_ids.add(row["id"])
+                if crawl is not None:
+                    crawl.visited.add(row["id"])
+                skip = row["id"] in checkpoint.done or (incremental and is_page_fresh(manifest, path, row))
+                if skip and (crawl is None or crawl.reuse_entry(row, unchanged=True)):
+                    continue
+                rows.append(row)
+            checkpoint.add_batch(
+                response.get("next_cursor"),
+                [row["id"] for row in response["results"]],
+                [row["id"] for row in rows],
+            )
+            for row in rows:
+                await queue_page(row)
+
+    if crawl is None:
+        return
+    database = await notion.databases.retrieve(database_id)
+    crawl.record(database_id, page_header(database), {"pages": sorted(seen_ids), "databases": []})
+    crawl.query_finished()
+    while (found := await crawl.discovered.get()) is not DONE:
+        if "database" not in found:
+            await queue_page(found)
+            continue
+        crawl.started()
+        try:
+            await query_linked_database(notion, found["database"], crawl, queue_page)
+        except Exception as error:
+            # Linked databases may not be shared with the integration
+            logging.warning(f"Skipping database {found['database']} linked from {database_id}: {error}")
+        crawl.settled()
+
+
+async def query_linked_database(notion, database_id, crawl, queue_page):
+    """Queues the pages of a database found by a crawl"""
+    database = await notion.databases.retrieve(database_id)
+    page_ids = []
+    async for row in paginate(notion.databases.query, database_id=database_id):
+        page_ids.append(row["id"])
+        if row["id"] in crawl.visited:
+            continue
+        crawl.visited.add(row["id"])
+        if not crawl.reuse_entry(row):
+            await queue_page({"id": row["id"], "last_edited_time": row["last_edited_time"], "linked": True})
+    crawl.record(database_id, page_header(database), {"pages": sorted(page_ids), "databases": []})
+
+
+async def fetch_page(notion, row, page_retries=2, page_query=None, page=None, skip_types=()) -> tuple:
+    """Fetches a page (unless given) and its blocks, trying the whole page
+    again 'page_retries' times when a request still fails after the retries
+    of the scheduler."""
+    for attempt in range(page_retries + 1):
+        tasks = [asyncio.ensure_future(metrics.timed(
+            "fetch.blocks", fetch_page_blocks(row["id"], notion, skip_types=skip_types),
+        ))]
+        if page is None:
+            tasks.append(asyncio.ensure_future(metrics.timed(
+                "fetch.page", notion.pages.retrieve(row["id"], **(page_query or {})),
+            )))
+        try:
+            results, *retrieved = await asyncio.gather(*tasks)
+            return (retrieved[0] if retrieved else page), results
+        except Exception as error:
+            for task in tasks:
+                task.cancel()
+            if attempt == page_retries:
+                raise
+            logging.warning(f"Retrying page {row['id']} after: {error}")
+
+
+async def fetch_assets(assets, page: dict, blocks: dict) -> list:
+    """Stores the files of a page or of some of its blocks, returning their URLs"""
+    if assets is None:
+        return []
+    urls = asset_urls(page, blocks)
+    if urls:
+        await metrics.timed("assets", asyncio.gather(*[assets.fetch(url) for url in urls]))
+    return urls
+
+
+async def stream_page(
+    notion, row, page_retries=2, page_query=None, page=None, skip_types=(), links=None, crawl=False, path=None,
+    dump_format="pretty", assets=None, window=4,
+) -> tuple:
+    """Fetches a page (unless given) and renders and dumps its blocks with a
+    `PageStream` as the subtrees of the next 'window' top-level blocks come
+    in, trying the whole page again 'page_retries' times like `fetch_page`.
+    The files of the blocks are stored in 'assets' before they are written.
+    Returns the page and the rendered page, whose outputs are yet to be
+    committed by the write stage."""
+    for attempt in range(page_retries + 1):
+        stream = None
+        try:
+            if page is None:
+                page = await metrics.timed("fetch.page", notion.pages.retrieve(row["id"], **(page_query or {})))
+            page = parse_frontmatter(page)
+            stream = PageStream(
+                f"build/{path}", row["id"], page, page_title(row["id"], page), dump_format, links,
+                assets.index if assets is not None else None, crawl,
+            )
+            stream.start(page["frontmatter"], await fetch_assets(assets, page, {}))
+            async for block in stream_page_blocks(row["id"], notion, skip_types=skip_types, window=window):
+                urls = await fetch_assets(assets, {}, {"results": [block]})
+                await metrics.timed("render", asyncio.to_thread(stream.add, block, urls))
+            return page, await asyncio.to_thread(stream.finish)
+        except BaseException as error:
+            if stream is not None:
+                stream.discard()
+            if attempt == page_retries or not isinstance(error, Exception):
+                raise
+            logging.warning(f"Retrying page {row['id']} after: {error}")
+
+
+async def fetch_pages(
+    notion, fetch_queue, render_queue, checkpoint, page_retries=2, page_query=None, crawl=None, stream_options=None,
+):
+    """Fetches the queued pages and their blocks for the render stage.
+
+    With 'stream_options' (the keyword arguments of `stream_page` from
+    'path' on), pages are rendered as they are fetched instead and go to
+    'render_queue' ready to be written.
+    """
+    skip_types = SUBPAGE_TYPES if crawl is not None else ()
+    while (row := await fetch_queue.get()) is not DONE:
+        # Cached responses of the page are valid as long as it was not edited
+        cache_version.set(row["last_edited_time"])
+        try:
+            page = None
+            if row["last_edited_time"] is None:
+                # Pages found by the crawl are only known by their id
+                page = await metrics.timed("fetch.page", notion.pages.retrieve(row["id"]))
+                row["last_edited_time"] = page["last_edited_time"]
+                cache_version.set(row["last_edited_time"])
+                if crawl.reuse_entry(row):
+                    crawl.settled()
+                    continue
+            metrics.page_started(row["id"])
+            # The properties of the query only apply to the exported database
+            query = None if row.get("linked") else page_query
+            if stream_options is not None:
+                # Rendered with the links of the last export, see `relink_pages`
+                previous = crawl.manifest["pages"].get(row["id"], {}).get("links", {}) if crawl is not None else None
+                page, rendered = await stream_page(
+                    notion, row, page_retries, query, page, skip_types, previous, crawl is not None, **stream_options,
+                )
+            else:
+                page, results = await fetch_page(notion, row, page_retries, query, page, skip_types)
+        except Exception as error:
+            if crawl is not None:
+                crawl.settled()
+            if row.get("linked") and isinstance(error, APIResponseError) and error.code == APIErrorCode.ObjectNotFound:
+                # Linked pages may not be shared with the integration
+                logging.warning(f"Skipping page {row['id']}, which is not shared with the integration")
+                metrics.page_finished(row["id"])
+                continue
+            # A page that cannot be fetched must not abort the export
+            logging.error(f"Failed to fetch page {row['id']}: {error}")
+            metrics.page_failed(row["id"])
+            checkpoint.page_failed(row, "fetch", error)
+            continue
+        if crawl is not None:
+            references = rendered.pop("references") if stream_options is not None else block_references(results)
+            details = {"header": page_header(page), "references": references}
+            crawl.record(row["id"], details["header"], details["references"])
+            # Rendered with the links of the last export, see `relink_pages`
+            previous = crawl.manifest["pages"].get(row["id"], {}).get("links", {})
+            details["links"] = crawl.page_links(row["id"], previous)
+            row["crawl"] = details
+            crawl.settled()
+        if stream_options is not None:
+            await render_queue.put((row, rendered))
+        else:
+            await render_queue.put((row, page, block_listing(results)))
+
+
+async def render_pages(
+    render_queue, write_queue, checkpoint, executor=None, dump_format="pretty", profile_dir=None, assets=False,
+):
+    """Renders fetched pages on 'executor' so that markdown conversion and JSON
+    serialization do not block the event loop (and the in-flight requests).
+
+    With a 'profile_dir', every render runs under cProfile and the stats of
+    each worker are dumped there.
+    """
+    loop = asyncio.get_running_loop()
+    while (item := await render_queue.get()) is not DONE:
+        row, page, blocks = item
+        render_args = (render_page, row["id"], page, blocks, dump_format, row.get("crawl", {}).get("links"), assets)
+        if profile_dir is not None:
+            render_args = (profile_call, profile_dir) + render_args
+        try:
+            rendered = await metrics.timed("render", loop.run_in_executor(executor, *render_args))
+        except Exception as error:
+            logging.error(f"Failed to render page {row['id']}: {error}")
+            metrics.page_failed(row["id"])
+            checkpoint.page_failed(row, "render", error)
+            continue
+        for stage, seconds in rendered.pop("timings").items():
+            metrics.record_stage(stage, seconds)
+        await write_queue.put((row, rendered))
+
+
+async def store_assets(asset_queue, write_queue, assets):
+    """Downloads the files of rendered pages while their presigned URLs are
+    valid, pointing the markdown at the stored copies."""
+    while (item := await asset_queue.get()) is not DONE:
+        row, rendered = item
+        urls = rendered.pop("assets")
+        if urls:
+            await metrics.timed("assets", asyncio.gather(*[assets.fetch(url) for url in urls]))
+            rendered["markdown"] = assets.localize(rendered["markdown"], urls)
+        await write_queue.put((row, rendered))
+
+
+async def write_pages(path, write_queue, manifest, writer, checkpoint, archive=None):
+    written = 0
+    while (item := await write_queue.get()) is not DONE:
+        row, rendered = item
+        try:
+            files, links = page_outputs(row["id"], rendered)
+            previous = manifest["pages"].get(row["id"], {}).get("outputs")
+            with metrics.timer("write"):
+                result = await writer.write(f"build/{path}", files, links, previous, rendered.get("streamed"))
+                if archive is not None and rendered.get("record") is not None:
+                    await asyncio.to_thread(archive.append_file, row["id"], rendered["record"].tmp_path)
+                    result["bytes"] += rendered["record"].size
+                elif archive is not None:
+                    await asyncio.to_thread(archive.append, row["id"], rendered["dumps"])
+                    result["bytes"] += len(rendered["dumps"])
+            record_page(
+                manifest, path, row["id"], row["last_edited_time"], rendered["title"], result["outputs"],
+                **row.get("crawl", {}),
+            )
+        except Exception as error:
+            logging.error(f"Failed to write page {row['id']}: {error}")
+            metrics.page_failed(row["id"])
+            checkpoint.page_failed(row, "write", error)
+            # Streamed outputs the writer did not commit are left in temporary files
+            for output in list(rendered.get("streamed", {}).values()) + [rendered.get("record")]:
+                if output is not None:
+                    output.discard()
+            continue
+        metrics.record_write(result)
+        metrics.page_finished(row["id"])
+        checkpoint.page_done(
+            row["id"], manifest["pages"][row["id"]],
+            archive.index[row["id"]] if archive is not None else None,
+        )
+        written += 1
+        if written % MANIFEST_SAVE_INTERVAL == 0:
+            save_manifest(path, manifest)
+            if archive is not None:
+                archive.save()
+    return written
+
+
+async def relink_pages(path, crawl, manifest, archive=None, site_url=None, assets=None) -> int:
+    """Builds the hierarchy of a crawl and renders again, from their dumps,
+    the pages whose links to crawled pages changed since they were rendered.
+    Returns the number of pages rendered again."""
+    hierarchy = crawl.build_hierarchy(site_url or "")
+    save_hierarchy(path, hierarchy)
+    links = crawl.link_targets(hierarchy, site_url)
+    writer = OutputWriter()
+    relinked = 0
+    for page_id in sorted(crawl.references):
+        entry = manifest["pages"].get(page_id)
+        if entry is None or "references" not in entry:
+            continue
+        page_links = crawl.page_links(page_id, links)
+        if page_links == entry.get("links", {}):
+            continue
+        archive_entry = archive.index.get(page_id) if archive is not None else None
+        page, blocks = await asyncio.to_thread(load_page_dump, path, page_id, archive_entry)
+        title, page_md = render_markdown(page_id, page, blocks, page_links)
+        if assets is not None:
+            page_md = assets.localize(page_md, asset_urls(page, blocks))
+        result = await writer.write(
+            f"build/{path}",
+            {f"{page_id}/{title}.md": page_md},
+            {f"_markdown/{title}.md": f"{page_id}/{title}.md"},
+            entry["outputs"],
+        )
+        outputs = {output: digest for output, digest in entry["outputs"].items() if not output.endswith(".md")}
+        outputs.update(result["outputs"])
+        record_page(
+            manifest, path, page_id, entry["last_edited_time"], title, outputs,
+            header=entry["header"], references=entry["references"], links=page_links,
+        )
+        relinked += 1
+    return relinked
+
+
+async def gather_or_cancel(*coroutines) -> list:
+    """`asyncio.gather`, cancelling the coroutines still running once one of
+    them failed (or the gather itself was cancelled)"""
+    tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+    try:
+        return await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def run_stage(workers, output_queue, consumers):
+    """Awaits every worker of a stage, then signals its consumers it is done"""
+    results = await gather_or_cancel(*workers)
+    for _ in range(consumers):
+        await output_queue.put(DONE)
+    return results
+
+
+async def download_database(
+    notion,
+    path,
+    database_id,
+    incremental=False,
+    page_concurrency=3,
+    queue_size=16,
+    executor=None,
+    render_workers=1,
+    dump_format="pretty",
+    profile_dir=None,
+    resume=False,
+    page_retries=2,
+    rows=None,
+    query_options=None,
+    recursive=False,
+    site_url=None,
+    assets=False,
+    asset_concurrency=8,
+    stream=False,
+) -> list:
+    """Exports a database through a query → fetch → render → write pipeline.
+
+    Stages are connected by bounded queues, so at most 'queue_size' pages wait
+    between two stages and memory stays bounded regardless of database size.
+    Progress is journaled to a `Checkpoint`; with 'resume' the export picks
+    up where an interrupted one stopped. Pages that fail are reported rather
+    than aborting the export, and their ids returned. 'rows' restricts the export to those query
+    rows (see `exporter.shards`). 'query_options' filter and sort the
+    database query (see `exporter.filters.database_query`).
+
+    With 'recursive', the export crawls the sub-pages, linked databases and
+    pages linked or mentioned from the exported pages, each fetched once
+    however many pages link to it, and points those links at the exported
+    markdown ('site_url' makes them point at the site URLs of the pages
+    instead). Needs dumps to relink pages.
+
+    With 'assets', the files Notion hosts for the pages are downloaded, at
+    most 'asset_concurrency' at a time, to an `AssetStore` between rendering
+    and writing, and the markdown links to the stored files.
+
+    With 'stream', pages are rendered and written as their blocks are
+    fetched (see `stream_page`), which bounds the memory a page takes
+    however large it is; rendering then runs on threads, not on 'executor'.
+    """
+    scheduler_share.set(database_id)
+    fetch_queue = asyncio.Queue(queue_size)
+    render_queue = asyncio.Queue(queue_size)
+    write_queue = asyncio.Queue(queue_size)
+    manifest = load_manifest(path)
+    archive = DumpArchive(path) if dump_format == "jsonl" else None
+    seen_ids = set()
+    query = await database_query(notion, database_id, **query_options) if query_options else {}
+    page_query = {"filter_properties": query["filter_properties"]} if "filter_properties" in query else None
+    checkpoint = Checkpoint(path, database_id, resume, query)
+    crawl = PageCrawl(database_id, path, manifest, incremental, checkpoint.done) if recursive else None
+    # Pages exported before the interruption may not have made it to the
+    # saved manifest and archive index
+    for page_id, record in checkpoint.done.items():
+        record_page(manifest, path, page_id, **record["entry"])
+        if archive is not None and "archive" in record:
+            archive.index[page_id] = record["archive"]
+
+    store = None
+    if assets:
+        store = AssetStore(path, aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=asset_concurrency)))
+    asset_queue = asyncio.Queue(queue_size) if store is not None and not stream else write_queue
+    stream_options = {"path": path, "dump_format": dump_format, "assets": store} if stream else None
+    stages = [
+        run_stage(
+            [query_pages(
+                notion, path, database_id, fetch_queue, manifest, seen_ids, checkpoint, incremental, rows, query,
+                crawl,
+            )],
+            fetch_queue, page_concurrency,
+        ),
+    ]
+    if stream:
+        stages.append(run_stage(
+            [
+                fetch_pages(
+                    notion, fetch_queue, write_queue, checkpoint, page_retries, page_query, crawl, stream_options,
+                )
+                for _ in range(page_concurrency)
+            ],
+            write_queue, 1,
+        ))
+    else:
+        stages.append(run_stage(
+            [
+                fetch_pages(notion, fetch_queue, render_queue, checkpoint, page_retries, page_query, crawl)
+                for _ in range(page_concurrency)
+            ],
+            render_queue, render_workers,
+        ))
+        stages.append(run_stage(
+            [
+                render_pages(render_queue, asset_queue, checkpoint, executor, dump_format, profile_dir, assets)
+                for _ in range(render_workers)
+            ],
+            asset_queue, page_concurrency if store is not None else 1,
+        ))
+    if store is not None and not stream:
+        stages.append(run_stage(
+            [store_assets(asset_queue, write_queue, store) for _ in range(page_concurrency)],
+            write_queue, 1,
+        ))
+    try:
+        *_, written = await gather_or_cancel(
+            *stages, write_pages(path, write_queue, manifest, OutputWriter(), checkpoint, archive),
+        )
+        logging.info(f"Exported {written} pages of database {database_id}")
+        if crawl is not None:
+            # Crawled pages are part of the export
+            seen_ids.update(crawl.visited)
+            relinked = await relink_pages(path, crawl, manifest, archive, site_url, store)
+            logging.info(f"Crawled {len(crawl.headers)} pages and databases, relinked {relinked} pages")
+
+        # Pages left out by a filter did not vanish from the database
+        if incremental and "filter" not in query:
+            vanished = prune_pages(manifest, path, seen_ids)
+            if vanished:
+                logging.info(f"Removed {len(vanished)} pages that vanished from the database")
+            if archive is not None:
+                for page_id in vanished:
+                    archive.remove(page_id)
+    finally:
+        if store is not None:
+            await store.session.close()
+            store.save()
+        # Pages written before a failure are kept for the next (or resumed) export
+        save_manifest(path, manifest)
+        if archive is not None:
+            archive.save()
+    if archive is not None:
+        archive.compact()
+    checkpoint.finish()
+    return sorted(checkpoint.failed)
@@ -0,0 +1,82 @@
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from parser.markdown_parser import import_renderers
+from .assets import AssetStore, asset_urls, localize_assets
+from .crawl import CRAWL_DETAILS
+from .dumps import DumpArchive, find_page_dump, load_page_dump
+from .manifest import load_manifest, record_page, save_manifest
+from .pipeline import render_markdown
+from .writer import OutputWriter
+
+
+def find_dumped_pages(path: str) -> dict:
+    """Ids of the pages of 'build/{path}' that have dumps, with their entry in
+    the dump archive if they are archived."""
+    page_ids = {}
+    for entry in os.scandir(f"build/{path}"):
+        if entry.is_dir() and find_page_dump(path, entry.name) is not None:
+            page_ids[entry.name] = None
+    for page_id, archive_entry in DumpArchive.load_index(path).items():
+        page_ids.setdefault(page_id, archive_entry)
+    return dict(sorted(page_ids.items()))
+
+
+def rerender_page(path: str, page_id: str, archive_entry=None, links=None, asset_index=None) -> dict:
+    """Renders a page again from its dumps, writing only the markdown files
+    whose content changed. 'links' are those of a recursive export, and
+    'asset_index' the files it stored (see `exporter.assets`)."""
+    page, blocks = load_page_dump(path, page_id, archive_entry)
+
+    title, page_md = render_markdown(page_id, page, blocks, links)
+    if asset_index:
+        page_md = localize_assets(page_md, asset_urls(page, blocks), asset_index)
+    result = OutputWriter().write_outputs(
+        f"build/{path}",
+        {f"{page_id}/{title}.md": page_md},
+        {f"_markdown/{title}.md": f"{page_id}/{title}.md"},
+    )
+    result["page_id"] = page_id
+    result["title"] = title
+    return result
+
+
+def _rerender_page(args):
+    return rerender_page(*args)
+
+
+def rerender_database(path: str, workers=None, renderers=()) -> int:
+    """Re-renders every dumped page of 'build/{path}' across 'workers'
+    processes, returning the number of markdown files that changed.
+    'renderers' are the modules registering custom renderers, see
+    `parser.markdown_parser.register_block`."""
+    page_ids = find_dumped_pages(path)
+    manifest = load_manifest(path)
+    asset_index = AssetStore.load_index(path)
+    changed = 0
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=import_renderers, initargs=(renderers,)) as executor:
+        tasks = [
+            (path, page_id, archive_entry, manifest["pages"].get(page_id, {}).get("links"), asset_index)
+            for page_id, archive_entry in page_ids.items()
+        ]
+        results = executor.map(_rerender_page, tasks, chunksize=16)
+        for result in results:
+            changed += len(result["written"])
+            entry = manifest["pages"].get(result["page_id"])
+            if entry is None:
+                continue
+            outputs = {
+                output: digest for output, digest in entry["outputs"].items()
+                if not output.endswith(".md")
+            }
+            outputs.update(result["outputs"])
+            details = {key: value for key, value in entry.items() if key in CRAWL_DETAILS}
+            record_page(
+                manifest, path, result["page_id"], entry["last_edited_time"], result["title"], outputs, **details,
+            )
+
+    save_manifest(path, manifest)
+    logging.info(f"Re-rendered {len(page_ids)} pages of {path}, {changed} markdown files changed")
+    return changed
@@ -0,0 +1,232 @@
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import random
+import time
+from collections import deque
+from contextvars import ContextVar
+
+import httpx
+from notion_client.errors import HTTPResponseError, RequestTimeoutError
+
+from .metrics import metrics
+
+RETRYABLE_STATUSES = (409, 429, 500, 502, 503, 504)
+
+# Who a request is made for (e.g. the database being exported); tokens are
+# handed out round-robin across shares so that no export starves the others
+scheduler_share = ContextVar("scheduler_share", default=None)
+
+
+class SharedTokenBucket:
+    """Token bucket kept in a file and updated under an exclusive lock, so
+    that several processes, on one host or on hosts sharing the filesystem,
+    draw from a single rate limit. Times are wall-clock since they are
+    compared across processes."""
+
+    def __init__(self, file_path: str, rate: float, burst: int):
+        self.file_path = file_path
+        self.rate = rate
+        self.burst = burst
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+    def update(self, change):
+        """Applies 'change' to the shared state under the lock, returning its result"""
+        with open(self.file_path, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                try:
+                    state = json.loads(f.read())
+                except json.JSONDecodeError:
+                    state = {"tokens": float(self.burst), "updated_at": time.time(), "paused_until": 0.0}
+                result = change(state)
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(state))
+                f.flush()
+                return result
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def take(self) -> float:
+        """Takes a token, returns 0 on success or else the seconds to wait"""
+        def take(state):
+            now = time.time()
+            if now < state["paused_until"]:
+                return state["paused_until"] - now
+            state["tokens"] = min(self.burst, state["tokens"] + (now - state["updated_at"]) * self.rate)
+            state["updated_at"] = now
+            if state["tokens"] >= 1:
+                state["tokens"] -= 1
+                return 0.0
+            return (1 - state["tokens"]) / self.rate
+        return self.update(take)
+
+    def pause(self, delay: float):
+        def pause(state):
+            state["paused_until"] = max(state["paused_until"], time.time() + delay)
+            state["tokens"] = 0.0
+        self.update(pause)
+
+
+class RequestScheduler:
+    """Meters every API request of an export.
+
+    Requests are admitted by a token bucket refilled at `rate` requests per
+    second (Notion allows an average of three) and bounded by an in-flight
+    limit that grows while latency stays under `target_latency` and halves
+    when it does not or when the API pushes back. Rate limited and failed
+    requests are retried, honoring `Retry-After`.
+
+    One scheduler can meter several exports: waiting requests are grouped by
+    their `scheduler_share` and served round-robin across groups. With a
+    'shared_bucket', tokens are drawn from a `SharedTokenBucket` so that
+    several processes share the rate limit.
+    """
+
+    def __init__(
+        self,
+        rate: float = 3.0,
+        burst: int = 3,
+        max_concurrency: int = 8,
+        max_retries: int = 5,
+        target_latency: float = 1.0,
+        shared_bucket: SharedTokenBucket = None,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.target_latency = target_latency
+        self.shared_bucket = shared_bucket
+
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        # share → futures of the requests waiting for a token, and the order
+        # in which shares with waiting requests are served
+        self.waiters = {}
+        self.rotation = deque()
+        self.dispatcher = None
+
+        self.concurrency = float(min(burst, max_concurrency))
+        self.in_flight = 0
+        self.slot_available = asyncio.Condition()
+
+    async def take_token(self):
+        if self.shared_bucket is not None:
+            while wait := await asyncio.to_thread(self.shared_bucket.take):
+                await asyncio.sleep(wait)
+            return
+        while True:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    async def dispatch(self):
+        """Hands out tokens to the waiting requests, one share at a time"""
+        while self.rotation:
+            await self.take_token()
+            while self.rotation:
+                share = self.rotation.popleft()
+                waiters = self.waiters[share]
+                waiter = waiters.popleft()
+                if waiters:
+                    self.rotation.append(share)
+                else:
+                    del self.waiters[share]
+                if not waiter.done():
+                    waiter.set_result(None)
+                    break
+            else:
+                # Every waiter was cancelled. A token of the shared bucket is
+                # lost rather than refunded through another locked update
+                if self.shared_bucket is None:
+                    self.tokens = min(self.burst, self.tokens + 1)
+
+    async def acquire_token(self):
+        share = scheduler_share.get()
+        waiter = asyncio.get_running_loop().create_future()
+        if share not in self.waiters:
+            self.waiters[share] = deque()
+            self.rotation.append(share)
+        self.waiters[share].append(waiter)
+        if self.dispatcher is None or self.dispatcher.done():
+            self.dispatcher = asyncio.ensure_future(self.dispatch())
+        await waiter
+
+    async def acquire_slot(self):
+        async with self.slot_available:
+            await self.slot_available.wait_for(lambda: self.in_flight < int(self.concurrency))
+            self.in_flight += 1
+
+    async def release_slot(self):
+        async with self.slot_available:
+            self.in_flight -= 1
+            self.slot_available.notify_all()
+
+    def on_success(self, latency: float):
+        if latency > self.target_latency:
+            self.concurrency = max(1.0, self.concurrency / 2)
+        else:
+            self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+
+    async def on_throttled(self, delay: float):
+        self.concurrency = max(1.0, self.concurrency / 2)
+        # A 429 applies to the whole integration, so every request waits
+        self.paused_until = max(self.paused_until, time.monotonic() + delay)
+        self.tokens = 0.0
+        if self.shared_bucket is not None:
+            await asyncio.to_thread(self.shared_bucket.pause, delay)
+
+    def retry_delay(self, error: Exception, attempt: int) -> float:
+        if isinstance(error, HTTPResponseError):
+            retry_after = error.headers.get("retry-after")
+            if retry_after is not None:
+                try:
+                    return float(retry_after)
+                except ValueError:
+                    pass
+        return min(60.0, 2 ** attempt) * (0.5 + random.random() / 2)
+
+    def is_retryable(self, error: Exception) -> bool:
+        if isinstance(error, HTTPResponseError):
+            return error.status in RETRYABLE_STATUSES
+        return isinstance(error, (RequestTimeoutError, httpx.TransportError))
+
+    async def call(self, request, *args, **kwargs):
+        attempt = 0
+        while True:
+            await self.acquire_token()
+            await self.acquire_slot()
+            started_at = time.monotonic()
+            try:
+                response = await request(*args, **kwargs)
+            except Exception as error:
+                if not self.is_retryable(error) or attempt >= self.max_retries:
+                    raise
+                delay = self.retry_delay(error, attempt)
+                metrics.retries += 1
+                if isinstance(error, HTTPResponseError) and error.status == 429:
+                    metrics.throttled += 1
+                    await self.on_throttled(delay)
+                else:
+                    self.concurrency = max(1.0, self.concurrency / 2)
+                logging.warning(f"Retrying request in {delay:.1f}s after: {error}")
+                attempt += 1
+            else:
+                self.on_success(time.monotonic() - started_at)
+                return response
+            finally:
+                await self.release_slot()
+            await asyncio.sleep(delay)
@@ -0,0 +1,205 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+
+from parser.notion_parser import paginate
+from .assets import ASSETS_DIR, AssetStore
+from .checkpoint import FAILURES_NAME
+from .dumps import DumpArchive
+from .manifest import is_page_fresh, load_manifest, prune_pages, record_page, save_manifest
+from .pipeline import download_database
+from .writer import write_atomic
+
+SHARDS_DIR = "shards"
+PARTITION_NAME = "partition.json"
+ROWS_NAME = "rows.json"
+DONE_NAME = "done"
+# How long the coordinator waits for workers started by hand, in seconds
+SHARD_TIMEOUT = 24 * 3600
+RATE_LIMIT_NAME = "ratelimit.json"
+
+
+def shard_of(page_id: str, shards: int) -> int:
+    """The shard of a page, stable across runs"""
+    return int(hashlib.sha256(page_id.encode("utf-8")).hexdigest(), 16) % shards
+
+
+def shards_root(path: str) -> str:
+    return f"build/{path}/{SHARDS_DIR}"
+
+
+def shard_path(path: str, shard: int) -> str:
+    """The export path (under `build/`) of the staging tree of a shard"""
+    return f"{path}/{SHARDS_DIR}/{shard}"
+
+
+def rate_limit_path(path: str) -> str:
+    """The `SharedTokenBucket` file of the processes exporting 'path'"""
+    return f"{shards_root(path)}/{RATE_LIMIT_NAME}"
+
+
+def load_partition(path: str):
+    try:
+        with open(f"{shards_root(path)}/{PARTITION_NAME}") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def save_partition(path: str, partition: dict):
+    write_atomic(f"{shards_root(path)}/{PARTITION_NAME}", json.dumps(partition, indent=2).encode("utf-8"))
+
+
+async def partition_database(notion, path, database_id, shards, incremental=False, resume=False, query=None) -> dict:
+    """Pages through the database query and splits the pages to export into
+    'shards' row files, one per staging tree.
+
+    'query' filters and sorts the database query, see `download_database`.
+    A resumed export reuses the partition of the interrupted one, so workers
+    pick up their checkpoints. Every run gets a new run id, which workers
+    write to their done marker.
+    """
+    partition = load_partition(path)
+    query = query or {}
+    if not (resume and partition is not None and partition["database_id"] == database_id
+            and partition["shards"] == shards and partition.get("query") == query):
+        for shard in range(partition["shards"] if partition else 0):
+            shutil.rmtree(f"build/{shard_path(path, shard)}", ignore_errors=True)
+        manifest = load_manifest(path)
+        page_ids = []
+        rows = [[] for _ in range(shards)]
+        async for row in paginate(notion.databases.query, database_id=database_id, **query):
+            page_ids.append(row["id"])
+            if incremental and is_page_fresh(manifest, path, row):
+                continue
+            rows[shard_of(row["id"], shards)].append({"id": row["id"], "last_edited_time": row["last_edited_time"]})
+        for shard, shard_rows in enumerate(rows):
+            os.makedirs(f"build/{shard_path(path, shard)}", exist_ok=True)
+            write_atomic(f"build/{shard_path(path, shard)}/{ROWS_NAME}", json.dumps(shard_rows).encode("utf-8"))
+        partition = {"database_id": database_id, "shards": shards, "query": query, "page_ids": page_ids}
+        logging.info(f"Partitioned {sum(map(len, rows))} pages of {database_id} into {shards} shards")
+
+    partition["run"] = uuid.uuid4().hex
+    # Written last, workers wait for it
+    save_partition(path, partition)
+    return partition
+
+
+async def export_shard(notion, path, database_id, shard, poll_interval=1.0, **options) -> None:
+    """Exports the pages of one shard of a partitioned database to its
+    staging tree, `build/{path}/shards/{shard}`, once the coordinator wrote
+    the partition."""
+    while (partition := load_partition(path)) is None or partition["database_id"] != database_id:
+        await asyncio.sleep(poll_interval)
+    with open(f"build/{shard_path(path, shard)}/{ROWS_NAME}") as f:
+        rows = json.load(f)
+    # The coordinator already left fresh pages out of the partition
+    options.pop("incremental", None)
+    await download_database(notion, shard_path(path, shard), database_id, rows=rows, **options)
+    run = load_partition(path)["run"]
+    write_atomic(f"build/{shard_path(path, shard)}/{DONE_NAME}", run.encode("utf-8"))
+
+
+def is_shard_done(path: str, shard: int, run: str) -> bool:
+    try:
+        with open(f"build/{shard_path(path, shard)}/{DONE_NAME}") as f:
+            return f.read() == run
+    except FileNotFoundError:
+        return False
+
+
+def wait_for_shards(path: str, partition: dict, timeout=SHARD_TIMEOUT, poll_interval=1.0):
+    """Waits for every shard of 'partition' to be done, raising TimeoutError
+    with the shards still missing after 'timeout' seconds"""
+    deadline = time.monotonic() + timeout
+    while True:
+        missing = [
+            str(shard) for shard in range(partition["shards"]) if not is_shard_done(path, shard, partition["run"])
+        ]
+        if not missing:
+            return
+        if time.monotonic() >= deadline:
+            raise TimeoutError(
+                f"Shards {', '.join(missing)} of {path} did not finish within {timeout:g}s, "
+                f"run them again with --resume to continue"
+            )
+        time.sleep(poll_interval)
+
+
+def merge_shards(path: str, partition: dict, incremental=False) -> list:
+    """Moves the outputs of every shard into `build/{path}` and records them
+    in its manifest, returning the ids of the pages that failed.
+
+    Shards and their pages are merged in order, so the merged tree does not
+    depend on which worker finished first. Outputs whose content did not
+    change are left untouched. The staging trees are removed unless pages
+    failed, in which case they are kept for `--resume`.
+    """
+    manifest = load_manifest(path)
+    archive = None
+    assets = AssetStore(path)
+    failures = {}
+    for shard in range(partition["shards"]):
+        staging = shard_path(path, shard)
+        # Stored files are named by their content, so shards never conflict
+        if os.path.isdir(f"build/{staging}/{ASSETS_DIR}"):
+            os.makedirs(assets.directory, exist_ok=True)
+            for entry in os.scandir(f"build/{staging}/{ASSETS_DIR}"):
+                if not entry.name.startswith("."):
+                    os.replace(entry.path, f"{assets.directory}/{entry.name}")
+            assets.index.update(AssetStore.load_index(staging))
+        shard_manifest = load_manifest(staging)
+        archive_index = DumpArchive.load_index(staging)
+        if archive_index and archive is None:
+            archive = DumpArchive(path)
+        for page_id, entry in sorted(shard_manifest["pages"].items()):
+            # Pages merged by an earlier run no longer have staged outputs
+            if not all(os.path.exists(f"build/{staging}/{output}") for output in entry["outputs"]):
+                continue
+            previous = manifest["pages"].get(page_id, {}).get("outputs", {})
+            for output, digest in entry["outputs"].items():
+                staged_path = f"build/{staging}/{output}"
+                file_path = f"build/{path}/{output}"
+                if previous.get(output) == digest and os.path.exists(file_path):
+                    os.remove(staged_path)
+                    continue
+                os.makedirs(os.path.dirname(file_path), exist_ok=True)
+                os.replace(staged_path, file_path)
+            record_page(manifest, path, page_id, entry["last_edited_time"], entry["slug"], entry["outputs"])
+            if page_id in archive_index:
+                archive.append(page_id, DumpArchive.read_bytes(staging, archive_index[page_id]))
+        try:
+            with open(f"build/{staging}/{FAILURES_NAME}") as f:
+                failures.update(json.load(f))
+        except FileNotFoundError:
+            pass
+
+    # Pages left out by a filter did not vanish from the database
+    if incremental and "filter" not in partition["query"]:
+        vanished = prune_pages(manifest, path, set(partition["page_ids"]))
+        if archive is not None:
+            for page_id in vanished:
+                archive.remove(page_id)
+    save_manifest(path, manifest)
+    assets.save()
+    if archive is not None:
+        archive.save()
+        archive.compact()
+
+    failures_path = f"build/{path}/{FAILURES_NAME}"
+    if failures:
+        write_atomic(failures_path, json.dumps(failures, indent=2, sort_keys=True).encode("utf-8"))
+        logging.error(
+            f"{len(failures)} pages of {partition['database_id']} failed, see {failures_path}; "
+            f"run again with --resume to retry them"
+        )
+    else:
+        if os.path.exists(failures_path):
+            os.remove(failures_path)
+        shutil.rmtree(shards_root(path), ignore_errors=True)
+    return sorted(failures)
@@ -0,0 +1,72 @@
+from parser.markdown_parser import MarkdownPostprocessor, decode_block, frontmatter_header, write_block
+from .assets import localize_assets
+from .crawl import block_references, rewrite_links
+from .dumps import DumpStream
+from .writer import StreamedOutput
+
+
+class PageStream:
+    """Renders and dumps a page one top-level block at a time, straight to
+    temporary output files, so that a block and its subtree can be released
+    once written.
+
+    The markdown is the same as `render_page`'s: `MarkdownPostprocessor`
+    holds back the lines the next block may still change. Links are pointed
+    at their 'links' targets and at the files of 'asset_index' chunk by
+    chunk. With 'crawl', the references of the blocks are collected.
+    """
+
+    def __init__(
+        self, root: str, page_id: str, page: dict, title: str, dump_format="pretty", links=None, asset_index=None,
+        crawl=False,
+    ):
+        self.page_id = page_id
+        self.title = title
+        self.links = links
+        self.asset_index = asset_index
+        self.references = {"pages": set(), "databases": set()} if crawl else None
+        self.urls = []
+        self.markdown = StreamedOutput(f"{root}/{page_id}/{title}.md")
+        self.postprocessor = MarkdownPostprocessor()
+        self.dumps = DumpStream(root, page_id, page, dump_format)
+
+    def write_markdown(self, page_md: str, urls=()):
+        if self.links:
+            page_md = rewrite_links(page_md, self.links)
+        if self.asset_index and urls:
+            page_md = localize_assets(page_md, urls, self.asset_index)
+        self.markdown.write(page_md.encode("utf-8"))
+
+    def start(self, frontmatter: dict, urls=()):
+        """Writes the front matter, 'urls' being the files of the page properties"""
+        self.write_markdown(frontmatter_header(frontmatter), urls)
+
+    def add(self, block: dict, urls=()):
+        """Writes a top-level block and its subtree, 'urls' being their files"""
+        write_block(self.postprocessor, decode_block(block), 0, self.page_id)
+        # Lines held back from the previous block are written with this one
+        held_urls, self.urls = self.urls, list(urls)
+        self.write_markdown(self.postprocessor.drain(), held_urls + self.urls)
+        self.dumps.add(block)
+        if self.references is not None:
+            references = block_references([block])
+            self.references["pages"].update(references["pages"])
+            self.references["databases"].update(references["databases"])
+
+    def finish(self) -> dict:
+        """Completes the outputs, returning the rendered page for the write stage"""
+        self.write_markdown(self.postprocessor.getvalue(), self.urls)
+        self.dumps.close()
+        rendered = {
+            "title": self.title,
+            "streamed": {f"{self.page_id}/{self.title}.md": self.markdown, **self.dumps.streamed},
+            "files": self.dumps.files,
+            "record": self.dumps.record,
+        }
+        if self.references is not None:
+            rendered["references"] = {key: sorted(ids) for key, ids in self.references.items()}
+        return rendered
+
+    def discard(self):
+        self.markdown.discard()
+        self.dumps.discard()
@@ -0,0 +1,69 @@
+import asyncio
+import json
+import logging
+
+from parser.notion_parser import paginate
+from parser.utils import slugify
+from .pipeline import download_database
+
+
+def load_export_config(file_path: str) -> list:
+    """Reads the databases to export from a JSON config file, a list of
+    `{"path": ..., "database_id": ...}` objects."""
+    with open(file_path) as f:
+        config = json.load(f)
+    exports = []
+    for entry in config:
+        if not entry.get("path") or not entry.get("database_id"):
+            raise ValueError(f"{file_path}: every database needs a path and a database_id, got {entry}")
+        exports.append((entry["path"], entry["database_id"]))
+    return exports
+
+
+def database_title(database: dict) -> str:
+    return slugify("".join(text["plain_text"] for text in database.get("title", [])))
+
+
+async def search_exports(notion, path: str) -> list:
+    """Every database shared with the integration, exported to
+    `build/{path}/{database title}`."""
+    databases = [
+        database async for database in paginate(
+            notion.search, filter={"property": "object", "value": "database"},
+        )
+    ]
+    exports = []
+    taken = set()
+    # Sorted so that databases with the same title always get the same paths
+    for database in sorted(databases, key=lambda database: database["id"]):
+        name = database_title(database) or database["id"]
+        if name in taken:
+            name = f"{name}-{database['id']}"
+        taken.add(name)
+        exports.append((f"{path}/{name}", database["id"]))
+    logging.info(f"Found {len(exports)} databases in the workspace")
+    return exports
+
+
+async def download_databases(notion, exports: list, database_concurrency=4, **options) -> list:
+    """Exports every `(path, database_id)` of 'exports' through the same
+    client, so they share its connection pool and request scheduler, at most
+    'database_concurrency' databases at a time.
+
+    Returns the ids of the databases whose export failed or left failed pages.
+    """
+    slots = asyncio.Semaphore(database_concurrency)
+    failed = []
+
+    async def export(path, database_id):
+        async with slots:
+            try:
+                if await download_database(notion, path, database_id, **options):
+                    failed.append(database_id)
+            except Exception as error:
+                # One broken database must not abort the others
+                logging.error(f"Failed to export database {database_id}: {error}")
+                failed.append(database_id)
+
+    await asyncio.gather(*[export(path, database_id) for path, database_id in exports])
+    return failed
@@ -0,0 +1,139 @@
+import asyncio
+import hashlib
+import os
+
+
+def write_atomic(file_path: str, data: bytes):
+    """Writes 'data' to a temporary file renamed over 'file_path', so readers
+    never see a partially written file."""
+    tmp_path = f"{file_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, file_path)
+
+
+def link_atomic(source: str, file_path: str) -> bool:
+    """Hardlinks 'source' over 'file_path', returns False when the filesystem
+    does not support it."""
+    tmp_path = f"{file_path}.{os.getpid()}.tmp"
+    try:
+        os.link(source, tmp_path)
+    except OSError:
+        return False
+    os.replace(tmp_path, file_path)
+    return True
+
+
+def file_hash(file_path: str):
+    try:
+        with open(file_path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+
+class StreamedOutput:
+    """An output written piece by piece to a temporary file and hashed on the
+    way, then committed by `OutputWriter.write_outputs`."""
+
+    def __init__(self, file_path: str):
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        self.tmp_path = f"{file_path}.{os.getpid()}.tmp"
+        self.file = open(self.tmp_path, "wb")
+        self.hash = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data: bytes):
+        self.file.write(data)
+        self.hash.update(data)
+        self.size += len(data)
+
+    def close(self) -> str:
+        """Closes the file, returning the hash of its content"""
+        self.file.close()
+        return self.hash.hexdigest()
+
+    def discard(self):
+        self.file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+class OutputWriter:
+    """Writes the build outputs of pages.
+
+    Files are written atomically and only when their content hash changed, so
+    downstream builds and rsync only see real changes. Copies of another
+    output (the `_markdown` copy of a page) are hardlinked to it.
+    """
+
+    def __init__(self):
+        self.created_dirs = set()
+
+    def makedirs(self, directory: str):
+        if directory not in self.created_dirs:
+            os.makedirs(directory, exist_ok=True)
+            self.created_dirs.add(directory)
+
+    def is_unchanged(self, file_path: str, digest: str, previous_digest=None) -> bool:
+        if previous_digest is not None:
+            return previous_digest == digest and os.path.exists(file_path)
+        return file_hash(file_path) == digest
+
+    def write_outputs(self, root: str, files: dict, links=None, previous=None, streamed=None) -> dict:
+        """Writes 'files' (output path relative to 'root' → str or bytes),
+        commits 'streamed' outputs (output path → `StreamedOutput`) and writes
+        'links' (output path → path in 'files' or 'streamed' it is a copy of).
+
+        'previous' maps outputs to the hashes they were last written with; when
+        an output is missing from it, the file on disk is hashed instead.
+        Returns the hash of every output, the outputs actually written and the
+        number of bytes written.
+        """
+        links = links or {}
+        previous = previous or {}
+        result = {"outputs": {}, "written": [], "bytes": 0}
+
+        for output, stream in (streamed or {}).items():
+            digest = stream.close()
+            file_path = os.path.join(root, output)
+            result["outputs"][output] = digest
+            if self.is_unchanged(file_path, digest, previous.get(output)):
+                stream.discard()
+                continue
+            os.replace(stream.tmp_path, file_path)
+            result["written"].append(output)
+            result["bytes"] += stream.size
+
+        for output, content in files.items():
+            data = content.encode("utf-8") if isinstance(content, str) else content
+            digest = hashlib.sha256(data).hexdigest()
+            file_path = os.path.join(root, output)
+            result["outputs"][output] = digest
+            if self.is_unchanged(file_path, digest, previous.get(output)):
+                continue
+            self.makedirs(os.path.dirname(file_path))
+            write_atomic(file_path, data)
+            result["written"].append(output)
+            result["bytes"] += len(data)
+
+        for output, source in links.items():
+            digest = result["outputs"][source]
+            file_path = os.path.join(root, output)
+            source_path = os.path.join(root, source)
+            result["outputs"][output] = digest
+            if source not in result["written"] and self.is_unchanged(file_path, digest, previous.get(output)):
+                continue
+            self.makedirs(os.path.dirname(file_path))
+            if not link_atomic(source_path, file_path):
+                with open(source_path, "rb") as f:
+                    data = f.read()
+                write_atomic(file_path, data)
+                result["bytes"] += len(data)
+            result["written"].append(output)
+
+        return result
+
+    async def write(self, root: str, files: dict, links=None, previous=None, streamed=None) -> dict:
+        """`write_outputs` on a worker thread, off the event loop"""
+        return await asyncio.to_thread(self.write_outputs, root, files, links, previous, streamed)
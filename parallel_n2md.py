@@ -2,92 +2,296 @@ import asyncio
 import os
 import sys
 import getopt
-import json
 import logging
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
-from notion_client import AsyncClient
 from dotenv import load_dotenv
 
-from parser.frontmatter_parser import parse_frontmatter
-from parser.markdown_parser import parse_markdown
-from parser.notion_parser import parse_blocks
-from parser.utils import slugify
+from exporter.cache import ResponseCache
+from exporter.client import ExportClient
+from exporter.dumps import check_dump_format
+from exporter.filters import database_query, parse_condition, parse_since
+from exporter.metrics import metrics
+from exporter.scheduler import RequestScheduler, SharedTokenBucket
+from exporter.shards import (
+    SHARD_TIMEOUT, export_shard, merge_shards, partition_database, rate_limit_path, wait_for_shards,
+)
+from exporter.workspace import download_databases, load_export_config, search_exports
+from parser.markdown_parser import import_renderers
 
 load_dotenv()
 
-semaphore = asyncio.Semaphore(3)
-notion = AsyncClient(
-    auth=os.environ["NOTION_TOKEN"],
-    log_level=logging.INFO,
-)
-
 
-async def download_page(page_id, path):
-    async with semaphore:
-        page = await notion.pages.retrieve(page_id)
-        blocks = await notion.blocks.children.list(page_id)
+EXECUTORS = {
+    "process": ProcessPoolExecutor,
+    "thread": ThreadPoolExecutor,
+}
 
-        page = parse_frontmatter(page)
-        results = []
-        for block in blocks["results"]:
-            block = await parse_blocks(block, notion)
-            results.append(block)
-        blocks["results"] = results
 
-        title = slugify(page["properties"]["Name"]["title"][0]["plain_text"])
-        page_md = parse_markdown(page_id, blocks, page["frontmatter"])
-        page_json = json.dumps(page, indent=2)
-        block_json = json.dumps(blocks, indent=2)
+async def export_databases(notion, exports, search_path=None, database_concurrency=4, **options) -> list:
+    """Exports 'exports', and with a 'search_path' every other database of the workspace"""
+    if search_path is not None:
+        listed = {database_id for _, database_id in exports}
+        exports = exports + [
+            (path, database_id) for path, database_id in await search_exports(notion, search_path)
+            if database_id not in listed
+        ]
+    return await download_databases(notion, exports, database_concurrency, **options)
 
-        if not os.path.exists(f"build/{path}/{page_id}"):
-            os.makedirs(f"build/{path}/{page_id}")
-        if not os.path.exists(f"build/{path}/_markdown"):
-            os.makedirs(f"build/{path}/_markdown")
 
-        with open(f"build/{path}/{page_id}/page.json", "w") as f:
-            f.write(page_json)
-        with open(f"build/{path}/{page_id}/block.json", "w") as f:
-            f.write(block_json)
-        with open(f"build/{path}/{page_id}/{title}.md", "w") as f:
-            f.write(page_md)
-        with open(f"build/{path}/_markdown/{title}.md", "w") as f:
-            f.write(page_md)
+async def export_sharded(
+    notion, path, database_id, shards, export_options, worker_argv=None, shard_timeout=SHARD_TIMEOUT,
+):
+    """Partitions the database, lets the shard workers export it, then merges
+    their staging trees. Without 'worker_argv' the workers are started by
+    hand with `--shard`, possibly on other hosts sharing `build/`, and are
+    waited for up to 'shard_timeout' seconds.
 
+    Returns whether the export failed: a shard did not finish or pages failed.
+    """
+    incremental = export_options.get("incremental", False)
+    query_options = export_options.get("query_options")
+    query = await database_query(notion, database_id, **query_options) if query_options else {}
+    partition = await partition_database(
+        notion, path, database_id, shards, incremental, export_options.get("resume", False), query,
+    )
+    if worker_argv is not None:
+        workers = [
+            await asyncio.create_subprocess_exec(sys.executable, sys.argv[0], *worker_argv, "--shard", str(shard))
+            for shard in range(shards)
+        ]
+        exit_codes = await asyncio.gather(*[worker.wait() for worker in workers])
+        crashed = [str(shard) for shard, exit_code in enumerate(exit_codes) if exit_code != 0]
+        if crashed:
+            logging.error(f"Shard workers {', '.join(crashed)} failed, run again with --resume to continue")
+            return True
+    try:
+        # Workers started here have all exited, their shards are done or never will be
+        await asyncio.to_thread(wait_for_shards, path, partition, 0 if worker_argv is not None else shard_timeout)
+    except TimeoutError as error:
+        logging.error(str(error))
+        return True
+    return bool(merge_shards(path, partition, incremental))
 
-async def parallel_download_pages(path, pages):
-    page_ids = [page["id"] for page in pages["results"]]
-    tasks = [download_page(page_id, path) for page_id in page_ids]
-    await asyncio.gather(*tasks)
 
+async def main(
+    exports,
+    scheduler,
+    export_options,
+    render_executor="process",
+    render_workers=None,
+    cache=None,
+    replay=False,
+    metrics_path=None,
+    base_url=None,
+    search_path=None,
+    database_concurrency=4,
+    shards=None,
+    shard=None,
+    worker_argv=None,
+    renderers=(),
+    shard_timeout=SHARD_TIMEOUT,
+) -> bool:
+    """Runs the export, returning whether anything failed"""
+    render_workers = render_workers or os.cpu_count() or 1
+    import_renderers(renderers)
+    with EXECUTORS[render_executor](
+        max_workers=render_workers, initializer=import_renderers, initargs=(renderers,),
+    ) as executor:
+        async with ExportClient(
+            scheduler,
+            cache=cache,
+            replay=replay,
+            **({"base_url": base_url} if base_url else {}),
+            auth=None if replay else os.environ["NOTION_TOKEN"],
+            log_level=logging.INFO,
+        ) as notion:
+            failed = []
+            sharded_failed = False
+            if shard is not None:
+                # Failed pages of a shard are reported by the coordinator once merged
+                await export_shard(
+                    notion, *exports[0], shard,
+                    executor=executor, render_workers=render_workers, **export_options,
+                )
+            elif shards is not None:
+                sharded_failed = await export_sharded(
+                    notion, *exports[0], shards, export_options, worker_argv, shard_timeout,
+                )
+            else:
+                failed = await export_databases(
+                    notion, exports, search_path, database_concurrency,
+                    executor=executor, render_workers=render_workers, **export_options,
+                )
+    print(metrics.summary(), file=sys.stderr)
+    if failed:
+        print(f"Failed to export databases, or some of their pages: {', '.join(failed)}", file=sys.stderr)
+    if metrics_path:
+        metrics.write_report(metrics_path)
+    return bool(failed) or sharded_failed
 
-async def download_database(path, database_id):
-    pages = None
-    start_cursor = None
 
-    while True:
-        if start_cursor is None:
-            pages = await notion.databases.query(database_id=database_id)
-            await parallel_download_pages(path, pages)
+if __name__ == "__main__":
+    argv = sys.argv[1:]
+    try:
+        opts, args = getopt.getopt(argv, 'p:d:i', [
+            'path=', 'database_id=', 'config=', 'search', 'databases=', 'incremental', 'pages=', 'queue-size=', 'render-executor=', 'render-workers=', 'cache', 'replay', 'dump=', 'metrics=', 'profile=', 'base-url=', 'resume', 'page-retries=', 'shards=', 'shard=', 'remote-workers', 'shard-timeout=',
+            'where=', 'edited-after=', 'status=', 'sort=', 'properties=', 'recursive', 'site-url=', 'assets', 'asset-concurrency=', 'stream', 'renderers=',
+            'rate=', 'burst=', 'max-concurrency=', 'max-retries=', 'target-latency=',
+        ])
+        path = ""
+        database_ids = []
+        config_path = None
+        search = False
+        database_concurrency = 4
+        render_executor = "process"
+        render_workers = None
+        renderers = []
+        cache = None
+        replay = False
+        metrics_path = None
+        base_url = None
+        shards = None
+        shard = None
+        remote_workers = False
+        shard_timeout = SHARD_TIMEOUT
+        export_options = {}
+        query_options = {}
+        scheduler_options = {}
+        for arg, val in opts:
+            if arg in ("-p", "--path"):
+                path = val
+            if arg in ("-d", "--database_id"):
+                database_ids.append(val)
+            if arg == "--config":
+                config_path = val
+            if arg == "--search":
+                search = True
+            if arg == "--databases":
+                database_concurrency = int(val)
+            if arg in ("-i", "--incremental"):
+                export_options["incremental"] = True
+            if arg == "--pages":
+                export_options["page_concurrency"] = int(val)
+            if arg == "--queue-size":
+                export_options["queue_size"] = int(val)
+            if arg == "--render-executor":
+                if val not in EXECUTORS:
+                    raise getopt.error(f"--render-executor must be one of {', '.join(EXECUTORS)}")
+                render_executor = val
+            if arg == "--render-workers":
+                render_workers = int(val)
+            if arg == "--renderers":
+                renderers = val.split(",")
+            if arg == "--dump":
+                try:
+                    check_dump_format(val)
+                except ValueError as err:
+                    raise getopt.error(str(err))
+                export_options["dump_format"] = val
+            if arg == "--metrics":
+                metrics_path = val
+            if arg == "--profile":
+                os.makedirs(val, exist_ok=True)
+                export_options["profile_dir"] = val
+            if arg == "--resume":
+                export_options["resume"] = True
+            if arg == "--page-retries":
+                export_options["page_retries"] = int(val)
+            if arg == "--where":
+                try:
+                    parse_condition(val)
+                except ValueError as err:
+                    raise getopt.error(str(err))
+                query_options.setdefault("where", []).append(val)
+            if arg == "--edited-after":
+                try:
+                    query_options["edited_after"] = parse_since(val)
+                except ValueError as err:
+                    raise getopt.error(str(err))
+            if arg == "--status":
+                query_options.setdefault("statuses", []).extend(val.split(","))
+            if arg == "--sort":
+                query_options.setdefault("sorts", []).append(val)
+            if arg == "--properties":
+                query_options["properties"] = val.split(",")
+            if arg == "--recursive":
+                export_options["recursive"] = True
+            if arg == "--site-url":
+                export_options["site_url"] = val
+            if arg == "--assets":
+                export_options["assets"] = True
+            if arg == "--asset-concurrency":
+                export_options["asset_concurrency"] = int(val)
+            if arg == "--stream":
+                export_options["stream"] = True
+            if arg == "--shards":
+                shards = int(val)
+            if arg == "--shard":
+                shard = int(val)
+            if arg == "--remote-workers":
+                remote_workers = True
+            if arg == "--shard-timeout":
+                shard_timeout = float(val)
+            if arg == "--base-url":
+                base_url = val
+            if arg == "--cache":
+                cache = ResponseCache()
+            if arg == "--replay":
+                cache = ResponseCache()
+                replay = True
+            if arg == "--rate":
+                scheduler_options["rate"] = float(val)
+            if arg == "--burst":
+                scheduler_options["burst"] = int(val)
+            if arg == "--max-concurrency":
+                scheduler_options["max_concurrency"] = int(val)
+            if arg == "--max-retries":
+                scheduler_options["max_retries"] = int(val)
+            if arg == "--target-latency":
+                scheduler_options["target_latency"] = float(val)
+        if query_options:
+            export_options["query_options"] = query_options
+        # A single database is exported to build/{path}, several to build/{path}/{database_id}
+        if len(database_ids) == 1 and not config_path and not search:
+            exports = [(path, database_ids[0])]
         else:
-            pages = await notion.databases.query(database_id=database_id, start_cursor=start_cursor)
-            await parallel_download_pages(path, pages)
-        if pages:
-            start_cursor = pages['next_cursor']
-            if start_cursor is None:
-                break
-
-
-argv = sys.argv[1:]
-try:
-    opts, args = getopt.getopt(argv, 'p:d:', ['path', 'database_id'])
-    path = ""
-    database_id = ""
-    for arg, val in opts:
-        if arg in ("-p", "--path"):
-            path = val
-        if arg in ("-d", "--database_id"):
-            database_id = val
-    asyncio.run(download_database(path, database_id))
+            exports = [(f"{path}/{database_id}", database_id) for database_id in database_ids]
+        if config_path:
+            try:
+                exports += load_export_config(config_path)
+            except (OSError, ValueError) as err:
+                raise getopt.error(str(err))
+        if not exports and not search:
+            raise getopt.error("pass a database id (-d), a --config file or --search")
+        if export_options.get("recursive") and export_options.get("dump_format") == "none":
+            raise getopt.error("--recursive relinks pages from their dumps, it cannot be used with --dump none")
+        worker_argv = None
+        if shards is not None or shard is not None:
+            if len(exports) != 1 or search:
+                raise getopt.error("--shards and --shard export a single database (-d)")
+            if export_options.get("recursive"):
+                raise getopt.error("--recursive exports cannot be sharded")
+            if shard is not None and not (shards and 0 <= shard < shards):
+                raise getopt.error("--shard takes a shard number below --shards")
+            # Every process of a sharded export draws from the same rate limit
+            scheduler_options["shared_bucket"] = SharedTokenBucket(
+                rate_limit_path(path), scheduler_options.get("rate", 3.0), scheduler_options.get("burst", 3),
+            )
+            if shard is None and not remote_workers:
+                worker_argv = argv
+                if render_workers is None:
+                    worker_argv = argv + ["--render-workers", str(max(1, (os.cpu_count() or 1) // shards))]
+        scheduler = RequestScheduler(**scheduler_options)
+        failed = asyncio.run(main(
+            exports, scheduler, export_options,
+            render_executor, render_workers, cache, replay, metrics_path, base_url,
+            path if search else None, database_concurrency,
+            shards if shard is None else None, shard, worker_argv, renderers, shard_timeout,
+        ))
+        if failed:
+            # Partial exports must not pass for complete ones in cron jobs and CI
+            sys.exit(1)
 
-except getopt.error as err:
-    print(str(err))
+    except getopt.error as err:
+        print(str(err))
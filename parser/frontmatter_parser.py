@@ -1,5 +1,8 @@
 import dateutil.parser as dt_parser
+import datetime
 import logging
+import re
+from functools import lru_cache
 from urllib.parse import urljoin
 from urllib.parse import urlparse
 from urllib.parse import unquote
@@ -120,87 +123,114 @@ def find_lists_in_dbs(structured_notion: dict):
     Each database by default is treated as gallery, but if any child page does
     not have a cover, we will treat it as list.
     """
-    for page_id, page in structured_notion["pages"].items():
-        if page["type"] == 'database':
-            for child_id in page["children"]:
-                if structured_notion["pages"][child_id]["cover"] is None:
-                    structured_notion["pages"][page_id]["db_list"] = True
-                    break
+    pages = structured_notion["pages"]
+    for page in pages.values():
+        if page["type"] == 'database' and \
+                any(pages[child_id]["cover"] is None for child_id in page["children"]):
+            page["db_list"] = True
 
 def parse_family_line(page_id: str, family_line: list, structured_notion: dict):
     """Parses the whole parental line for page with 'page_id'"""
-    if page_id in structured_notion['pages'] and structured_notion['pages'][page_id]["parent"] is not None:
-        par_id = structured_notion["pages"][page_id]["parent"]
-        family_line.insert(0, par_id)
-        family_line = parse_family_line(par_id, family_line, structured_notion)
-
+    pages = structured_notion["pages"]
+    ancestors = []
+    while page_id in pages and pages[page_id]["parent"] is not None:
+        page_id = pages[page_id]["parent"]
+        ancestors.append(page_id)
+    family_line[:0] = reversed(ancestors)
     return family_line
 
 def parse_family_lines(structured_notion: dict):
-    for page_id, page in structured_notion["pages"].items():
-        page["family_line"] = parse_family_line(page_id, [], structured_notion)
+    """Parses the parental line of every page.
 
-def generate_urls(page_id:str, structured_notion: dict, config: dict):
-    """Generates url for each page nested in page with 'page_id'"""
-    if structured_notion["pages"][page_id]["title"]:
-        if page_id == structured_notion["root_page_id"]:
-            if config["build_locally"]:
-                f_name = structured_notion["pages"][page_id]["title"].replace(" ",
-                                                                            "_")
-                f_name = f_name.replace("$", "_")
-                f_name = f_name.replace("\\", "_")
-            else:
-                f_name = 'index'
+    Lines are memoized by page, so each page walks up only to the first
+    ancestor whose line is already known.
+    """
+    pages = structured_notion["pages"]
+    family_lines = {}
+    for page_id in pages:
+        chain = []
+        ancestor = page_id
+        while ancestor not in family_lines and ancestor in pages and pages[ancestor]["parent"] is not None:
+            if len(chain) > len(pages):
+                raise ValueError(f"the parents of {page_id} form a cycle")
+            chain.append(ancestor)
+            ancestor = pages[ancestor]["parent"]
+        family_line = family_lines.setdefault(ancestor, [])
+        for child_id in reversed(chain):
+            family_line = family_line + [pages[child_id]["parent"]]
+            family_lines[child_id] = family_line
+    for page_id, page in pages.items():
+        page["family_line"] = family_lines[page_id]
+
+def url_name(title: str) -> str:
+    return title.replace(" ", "_").replace("$", "_").replace("\\", "_")
 
-            f_name += '.html'
+def generate_urls(page_id:str, structured_notion: dict, config: dict):
+    """Generates url for each page nested in page with 'page_id'
 
+    Pages are visited depth-first in the order of their parents' children. A
+    name taken in a directory gets underscores appended until it is free;
+    the underscores tried per directory and name are remembered, so that
+    siblings with the same title do not probe every taken url again.
+    """
+    pages = structured_notion["pages"]
+    registry = set(structured_notion["urls"])
+    collisions = {}
+
+    def page_url(directory, name):
+        if config["build_locally"]:
+            return str((Path(directory) / name / name).resolve()) + '.html'
+        return urljoin(directory, name)
+
+    stack = [page_id]
+    while stack:
+        page_id = stack.pop()
+        page = pages[page_id]
+        if not page["title"]:
+            continue
+        if page_id == structured_notion["root_page_id"]:
             if config["build_locally"]:
-                f_url = str(Path(config["output_dir"]).resolve() / f_name)
+                f_url = str(Path(config["output_dir"]).resolve() / (url_name(page["title"]) + '.html'))
             else:
                 f_url = config["site_url"]
-            structured_notion["pages"][page_id]["url"] = f_url
-            structured_notion["urls"].append(f_url)
         else:
+            parent_url = pages[page["parent"]]["url"]
             if config["build_locally"]:
-                parent_id = structured_notion["pages"][page_id]["parent"]
-                parent_url = structured_notion["pages"][parent_id]["url"]
-                f_name = structured_notion["pages"][page_id]["title"].replace(" ",
-                                                                            "_")
-                f_name = f_name.replace("$", "_")
-                f_name = f_name.replace("\\", "_")
-
-                f_url = Path(parent_url).parent.resolve()
-                f_url = f_url / f_name / f_name
-                f_url = str(f_url.resolve()) + '.html'
-                while f_url in structured_notion["urls"]:
-                    f_name += "_"
-                    f_url = Path(parent_url).parent
-                    f_url = f_url / f_name / f_name
-                    f_url = str(f_url.resolve()) + '.html'
-                structured_notion["pages"][page_id]["url"] = f_url
-                structured_notion["urls"].append(f_url)
+                directory = str(Path(parent_url).parent.resolve())
             else:
-                parent_id = structured_notion["pages"][page_id]["parent"]
-                parent_url = structured_notion["pages"][parent_id]["url"]
-                parent_url += '/'
-                f_name = structured_notion["pages"][page_id]["title"].replace(" ",
-                                                                            "_")
-                f_name = f_name.replace("$", "_")
-                f_name = f_name.replace("\\", "_")
-                f_url = urljoin(parent_url, f_name)
-                while f_url in structured_notion["urls"]:
-                    f_name += "_"
-                    f_url = urljoin(parent_url, f_name)
-                structured_notion["pages"][page_id]["url"] = f_url
-                structured_notion["urls"].append(f_url)
-
-        for child_id in structured_notion["pages"][page_id]["children"]:
-            generate_urls(child_id, structured_notion, config)
+                directory = parent_url + '/'
+            f_name = url_name(page["title"])
+            suffix = collisions.get((directory, f_name), 0)
+            while (f_url := page_url(directory, f_name + "_" * suffix)) in registry:
+                suffix += 1
+            collisions[(directory, f_name)] = suffix
+        page["url"] = f_url
+        registry.add(f_url)
+        structured_notion["urls"].append(f_url)
+        stack.extend(reversed(page["children"]))
 
 # ======================
 # Properties handlers
 # ======================
 
+# Dates and datetimes of the API, which start with the day
+ISO_DAY = re.compile(r"[1-9]\d{3}-\d{2}-\d{2}(?:T|$)")
+
+
+@lru_cache(maxsize=4096)
+def iso_date(value: str) -> str:
+    """The day of an ISO 8601 date or datetime, as %Y-%m-%d.
+
+    Pages share most of their dates (creation days, due dates), so days are
+    cached; the ones the API returns are read without dateutil."""
+    if ISO_DAY.match(value):
+        try:
+            datetime.date(int(value[:4]), int(value[5:7]), int(value[8:10]))
+            return value[:10]
+        except ValueError:
+            pass
+    return dt_parser.isoparse(value).strftime("%Y-%m-%d")
+
 def p_rich_text(property:dict)->str:
     md_property = markdown_parser.richtext_convertor(property['rich_text'])
     return md_property
@@ -228,10 +258,10 @@ def p_date(property:dict)->str:
     md_property = ''
     if property['date'] is not None:
         dt = property['date']['start']
-        md_property += dt_parser.isoparse(dt).strftime("%Y-%m-%d")
+        md_property += iso_date(dt)
         if property['date']['end'] is not None:
             dt = property['date']['end']
-            md_property += ' - ' + dt_parser.isoparse(dt).strftime("%Y-%m-%d")
+            md_property += ' - ' + iso_date(dt)
     return md_property
 
 def p_people(property:dict)->str:
@@ -284,7 +314,7 @@ def p_created_time(property:dict)->str:
     md_property = ''
     if property['created_time'] is not None:
         dt = property['created_time']
-        md_property += dt_parser.isoparse(dt).strftime("%Y-%m-%d")
+        md_property += iso_date(dt)
     return md_property
 
 # def p_created_by(property:dict)->str:
@@ -295,7 +325,7 @@ def p_last_edited_time(property:dict)->str:
     md_property = ''
     if property['last_edited_time'] is not None:
         dt = property['last_edited_time']
-        md_property += dt_parser.isoparse(dt).strftime("%Y-%m-%d")
+        md_property += iso_date(dt)
     return md_property
 
 # def p_last_edited_by(property:dict)->str:
@@ -303,31 +333,41 @@ def p_last_edited_time(property:dict)->str:
 #     return md_property
 
 
+properties_map = {
+    "rich_text": p_rich_text,
+    "number": p_number,
+    "select": p_select,
+    "multi_select": p_multi_select,
+    "date": p_date,
+    "people": p_people,
+    "files": p_files,
+    "checkbox": p_checkbox,
+    # "url": p_url,
+    "email": p_email,
+    "phone_number": p_phone_number,
+    # "formula": p_formula,
+    # "relation": p_relation,
+    # "rollup": p_rollup,
+    "created_time": p_created_time,
+    # "created_by": p_created_by,
+    "last_edited_time": p_last_edited_time,
+    # "last_edited_by": p_last_edited_by
+}
+
+
+@lru_cache(maxsize=256)
+def schema_plan(schema: tuple) -> tuple:
+    """The (name, handler) of the properties of a schema ((name, type) of
+    each property) that go to the front matter, in order"""
+    return tuple(
+        (property_title, properties_map[property_type])
+        for property_title, property_type in schema if property_type in properties_map
+    )
+
+
 def parse_frontmatter(page: dict):
-    properties_map = {
-        "rich_text": p_rich_text,
-        "number": p_number,
-        "select": p_select,
-        "multi_select": p_multi_select,
-        "date": p_date,
-        "people": p_people,
-        "files": p_files,
-        "checkbox": p_checkbox,
-        # "url": p_url,
-        "email": p_email,
-        "phone_number": p_phone_number,
-        # "formula": p_formula,
-        # "relation": p_relation,
-        # "rollup": p_rollup,
-        "created_time": p_created_time,
-        # "created_by": p_created_by,
-        "last_edited_time": p_last_edited_time,
-        # "last_edited_by": p_last_edited_by
-    }
-    page["frontmatter"] = {}
-    for property_title, property in page.get("properties", {}).items():
-        if property["type"] == "title":
-            continue
-        if property["type"] in properties_map:
-            page["frontmatter"][property_title] = properties_map[property['type']](property)
+    properties = page.get("properties", {})
+    # The rows of a database share their schema, which is planned once
+    plan = schema_plan(tuple((property_title, property["type"]) for property_title, property in properties.items()))
+    page["frontmatter"] = {property_title: handler(properties[property_title]) for property_title, handler in plan}
     return page
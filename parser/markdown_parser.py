@@ -1,6 +1,8 @@
 # Most of the code was taken from the Notion2md repository
 # https://github.com/echo724/notion2md/tree/main/notion2md
 
+import importlib
+from operator import itemgetter
 from pathlib import Path
 from urllib.parse import urljoin
 from urllib.parse import urlparse
@@ -8,64 +10,83 @@ from urllib.parse import unquote
 from . import utils
 
 
-def paragraph(information: dict) -> str:
-    return information['rich_text']
+class Block:
+    """A block as renderers read it, decoded once from the API's JSON by
+    `decode_block`.
+
+    Rich text and captions are already converted to markdown, and 'render'
+    is the renderer of the block type, or None for unsupported types.
+    'payload' is the raw payload of the block type, for custom renderers.
+    'children' are left raw, and decoded as they are rendered.
+    """
+
+    __slots__ = (
+        "id", "type", "render", "payload", "rich_text", "icon", "checked", "url", "caption", "language", "cells",
+        "title", "children",
+    )
+
+    def __init__(self, block_id: str, block_type: str, render=None, payload=None):
+        self.id = block_id
+        self.type = block_type
+        self.render = render
+        self.payload = payload
+        self.rich_text = None
+        self.icon = None
+        self.checked = None
+        self.url = None
+        self.caption = None
+        self.language = None
+        self.cells = None
+        self.title = None
+        self.children = None
+
+
+def paragraph(block: Block) -> str:
+    return block.rich_text
 
 
-def heading_1(information: dict) -> str:
-    return f"# {information['rich_text']}"
+def heading_1(block: Block) -> str:
+    return f"# {block.rich_text}"
 
 
-def heading_2(information: dict) -> str:
-    return f"## {information['rich_text']}"
+def heading_2(block: Block) -> str:
+    return f"## {block.rich_text}"
 
 
-def heading_3(information: dict) -> str:
-    return f"### {information['rich_text']}"
+def heading_3(block: Block) -> str:
+    return f"### {block.rich_text}"
 
 
-def callout(information: dict) -> str:
-    return f"{information.get('icon')} {information['rich_text']}"
+def callout(block: Block) -> str:
+    return f"{block.icon} {block.rich_text}"
 
 
-def quote(information: dict) -> str:
-    return f"> {information['rich_text']}"
+def quote(block: Block) -> str:
+    return f"> {block.rich_text}"
 
 # toggle item will be changed as bulleted list item
 
 
-def bulleted_list_item(information: dict) -> str:
-    return f"* {information['rich_text']}"
+def bulleted_list_item(block: Block) -> str:
+    return f"* {block.rich_text}"
 
 # numbering is not supported
 
 
-def numbered_list_item(information: dict) -> str:
-    """
-    input: item:dict = {"number":int, "text":str}
-    """
-    return f"1. {information['rich_text']}"
+def numbered_list_item(block: Block) -> str:
+    return f"1. {block.rich_text}"
 
 
-def to_do(information: dict) -> str:
-    """
-    input: item:dict = {"checked":bool, "test":str}
-    """
-    return f"- {'[x]' if information['checked'] else '[ ]'} {information['rich_text']}"
+def to_do(block: Block) -> str:
+    return f"- {'[x]' if block.checked else '[ ]'} {block.rich_text}"
 
 
-def code(information: dict) -> str:
-    """
-    input: item:dict = {"language":str,"text":str}
-    """
-    return f"```{information['language'].replace(' ', '_')}\n{information['rich_text']}\n```"
+def code(block: Block) -> str:
+    return f"```{block.language.replace(' ', '_')}\n{block.rich_text}\n```"
 
 
-def embed(information: dict) -> str:
-    """
-    input: item:dict ={"url":str,"text":str}
-    """
-    embed_link = information["url"]
+def embed(block: Block) -> str:
+    embed_link = block.url
 
     block_md = f"""<p><div class="res_emb_block">
 <iframe width="640" height="480" src="{embed_link}" frameborder="0" allowfullscreen></iframe>
@@ -74,39 +95,33 @@ def embed(information: dict) -> str:
     return block_md
 
 
-def image(information: dict) -> str:
-    """
-    input: item:dict ={"url":str,"text":str,"caption":str}
-    """
-    image_name = information['url']
+def image(block: Block) -> str:
+    image_name = block.url
 
-    if information['caption']:
-        return f"![{information['caption']}]({image_name})"
+    if block.caption:
+        return f"![{block.caption}]({image_name})"
     else:
         return f"![]({image_name})"
 
 
-def file(information: dict) -> str:
-    filename = information['url']
+def file(block: Block) -> str:
+    filename = block.url
     clean_url = urljoin(filename, urlparse(filename).path)
     return f"[📎 {unquote(Path(clean_url).name)}]({filename})"
 
 
-def bookmark(information: dict) -> str:
-    """
-    input: item:dict ={"url":str,"text":str,"caption":str}
-    """
-    if information['caption']:
-        return f"![{information['caption']}]({information['url']})"
+def bookmark(block: Block) -> str:
+    if block.caption:
+        return f"![{block.caption}]({block.url})"
     else:
-        return f"![]({information['url']})"
+        return f"![]({block.url})"
 
 
-def equation(information: dict) -> str:
-    return f"$$ {information['rich_text']} $$"
+def equation(block: Block) -> str:
+    return f"$$ {block.rich_text} $$"
 
 
-def divider(information: dict) -> str:
+def divider(block: Block) -> str:
     return f"---"
 
 
@@ -114,18 +129,16 @@ def blank() -> str:
     return "\n"
 
 
-def table_row(information: list) -> list:
-    """
-    input: item:list = [[richtext],....]
-    """
+def table_row(block: Block) -> list:
+    """The markdown of each cell of the row"""
     column_list = []
-    for column in information['cells']:
+    for column in block.cells:
         column_list.append(richtext_convertor(column))
     return column_list
 
 
-def video(information: dict) -> str:
-    youtube_link = information["url"]
+def video(block: Block) -> str:
+    youtube_link = block.url
     clean_url = \
         urljoin(youtube_link, urlparse(youtube_link).path)
     is_webm = clean_url.endswith(".webm")
@@ -141,6 +154,35 @@ def video(information: dict) -> str:
     return block_md
 
 
+def notion_url(object_id: str) -> str:
+    return f"https://www.notion.so/{object_id.replace('-', '')}"
+
+
+# Blocks linking to another page have its notion.so URL as 'url'
+
+
+def child_page(block: Block) -> str:
+    return f"[{block.title or block.url}]({block.url})"
+
+
+def child_database(block: Block) -> str:
+    return f"[{block.title or block.url}]({block.url})"
+
+
+def link_to_page(block: Block) -> str:
+    return f"[{block.url}]({block.url})"
+
+
+def container(block: Block) -> str:
+    """Blocks that only group their children, which take their place"""
+    return ""
+
+
+def table_of_contents(block: Block) -> str:
+    # Filled in by the toc extension of Python-Markdown
+    return "[TOC]"
+
+
 block_type_map = {
     "paragraph": paragraph,
     "heading_1": heading_1,
@@ -152,7 +194,6 @@ block_type_map = {
     "bulleted_list_item": bulleted_list_item,
     "numbered_list_item": numbered_list_item,
     "to_do": to_do,
-    # "child_page": child_page,
     "code": code,
     "embed": embed,
     "image": image,
@@ -161,103 +202,126 @@ block_type_map = {
     "divider": divider,
     "file": file,
     'table_row': table_row,
-    "video": video
+    "video": video,
+    "child_page": child_page,
+    "child_database": child_database,
+    "link_to_page": link_to_page,
+    "column_list": container,
+    "column": container,
+    "synced_block": container,
+    "table_of_contents": table_of_contents,
 }
 
-
-def blocks_convertor(blocks: object, page_id) -> str:
-    results = []
-    for block in blocks["results"]:
-        block_md = block_convertor(block, 0, page_id)
-        results.append(block_md)
-
-    outcome_blocks = "".join([result for result in results])
-    return outcome_blocks
+# Block types whose children are rendered as siblings of the block
+container_types = {"column_list", "column", "synced_block"}
 
 
-def information_collector(payload: dict, page_id) -> dict:
-    information = dict()
+def decode_block(block: dict) -> Block:
+    """Decodes the fields the renderer of a block reads from its payload"""
+    block_type = block.get("type")
+    render = block_type_map.get(block_type)
+    decoded = Block(block["id"], block_type, render, block.get(block_type))
+    if "has_children" in block and "children" in block:
+        decoded.children = block["children"]
+    if render is None:
+        return decoded
+
+    payload = decoded.payload
     if "rich_text" in payload:
-        information['rich_text'] = richtext_convertor(payload['rich_text'])
+        decoded.rich_text = richtext_convertor(payload['rich_text'])
     if "icon" in payload and "emoji" in payload["icon"]:
-        information['icon'] = payload['icon']['emoji']
+        decoded.icon = payload['icon']['emoji']
     if "checked" in payload:
-        information['checked'] = payload['checked']
+        decoded.checked = payload['checked']
     if "expression" in payload:
-        information['rich_text'] = payload['expression']
+        decoded.rich_text = payload['expression']
     if "url" in payload:
-        information['url'] = payload['url']
+        decoded.url = payload['url']
     if "caption" in payload:
-        information['caption'] = richtext_convertor(payload['caption'])
+        decoded.caption = richtext_convertor(payload['caption'])
     if "external" in payload:
-        information['url'] = payload['external']['url']
+        decoded.url = payload['external']['url']
     if "language" in payload:
-        information['language'] = payload['language']
-
+        decoded.language = payload['language']
     # internal url
     if "file" in payload:
-        information['url'] = payload['file']['url']
-        clean_url = \
-            urljoin(information['url'], urlparse(information['url']).path)
-        is_webm = clean_url.endswith(".webm")
-
+        decoded.url = payload['file']['url']
     # table cells
     if "cells" in payload:
-        information['cells'] = payload['cells']
+        decoded.cells = payload['cells']
 
-    return information
+    if block_type == "child_page" or block_type == "child_database":
+        decoded.title = payload["title"]
+        decoded.url = notion_url(block["id"])
+    elif block_type == "link_to_page":
+        decoded.url = notion_url(payload[payload["type"]])
+    return decoded
+
+
+def blocks_convertor(blocks: object, page_id) -> str:
+    fragments = []
+    for block in blocks["results"]:
+        write_block(fragments, decode_block(block), 0, page_id)
+    return "".join(fragments)
 
 
 def block_convertor(block: object, depth=0, page_id='') -> str:
-    outcome_block: str = ""
-    block_type = block.get("type")
+    fragments = []
+    write_block(fragments, decode_block(block), depth, page_id)
+    return "".join(fragments)
+
+
+def write_block(fragments, block: Block, depth=0, page_id=''):
+    """Appends the markdown of 'block' and its children to 'fragments' (a list
+    or a `MarkdownPostprocessor`).
+
+    Fragments are joined once per page, which keeps rendering linear in the
+    size of the block tree however deeply it is nested.
+    """
+    block_type = block.type
 
-    if block_type in block_type_map:
-        outcome_block = block_type_map[block_type](
-            information_collector(block[block_type], page_id)) + "\n\n"
+    if block.render is not None:
+        outcome_block = block.render(block)
+        # Containers without markdown of their own leave no empty line
+        if outcome_block or block_type not in container_types:
+            outcome_block += "\n\n"
     else:
-        outcome_block = f"<!-- {block_type} {block['id']} -->\n\n"
+        outcome_block = f"<!-- {block_type} {block.id} -->\n\n"
 
     if block_type == "code":
         outcome_block = outcome_block.rstrip(
-            '\n').replace('\n', '\n'+'\t'*depth)
-        outcome_block += '\n\n'
-
-    if all(k in block for k in ("has_children", "children")):
-        if block_type == 'table':
-            depth += 1
-            child_blocks = block["children"]
-            table_list = []
-            for cell_block in child_blocks:
-                cell_block_type = cell_block['type']
-                table_list.append(block_type_map[cell_block_type](
-                    information_collector(cell_block[cell_block_type], page_id))
-                )
-            # convert to markdown table
-            for index, value in enumerate(table_list):
-                if index == 0:
-                    outcome_block = " | " + \
-                        " | ".join(value) + " | " + "\n"
-                    outcome_block += " | " + \
-                        " | ".join(['----'] * len(value)) + \
-                        " | " + "\n"
-                    continue
-                outcome_block += " | " + \
-                    " | ".join(value) + " | " + "\n"
-            outcome_block += "\n"
-        else:
-            depth += 1
-            child_blocks = block["children"]
-            for block in child_blocks:
-                # This is needed, because notion thinks, that if
-                # the page contains numbered list, header 1 will be the
-                # child block for it, which is strange.
-                if block['type'] == "heading_1":
-                    depth = 0
-                block_md = block_convertor(block, depth, page_id)
-                outcome_block += block_md
-
-    return outcome_block
+            '\n').replace('\n', '\n'+'\t'*depth) + '\n\n'
+
+    if block.children is None:
+        fragments.append(outcome_block)
+        return
+
+    if block_type not in container_types:
+        depth += 1
+    child_blocks = block.children
+    if block_type == 'table':
+        table_list = []
+        for cell_block in child_blocks:
+            cell_block = decode_block(cell_block)
+            table_list.append(cell_block.render(cell_block))
+        # convert to markdown table, which replaces the block itself
+        if not table_list:
+            fragments.append(outcome_block)
+        for index, value in enumerate(table_list):
+            fragments.append(" | " + " | ".join(value) + " | " + "\n")
+            if index == 0:
+                fragments.append(" | " + " | ".join(['----'] * len(value)) + " | " + "\n")
+        fragments.append("\n")
+    else:
+        fragments.append(outcome_block)
+        for block in child_blocks:
+            # This is needed, because notion thinks, that if
+            # the page contains numbered list, header 1 will be the
+            # child block for it, which is strange.
+            if block['type'] == "heading_1":
+                depth = 0
+            write_block(fragments, decode_block(block), depth, page_id)
+
 
 # Link
 
@@ -307,6 +371,40 @@ annotation_map = {
     "code": a_code,
 }
 
+# The wrapper of each combination of annotations met so far, keyed by the
+# values of the annotations of `annotation_map` and the color
+_annotation_wrappers = {}
+_annotation_key = itemgetter(*annotation_map, "color")
+
+
+def annotation_wrapper(annotations: dict):
+    """The function applying 'annotations' to the markdown of a text run, or
+    None when there is nothing to apply. Compiled once per combination."""
+    try:
+        key = _annotation_key(annotations)
+    except KeyError:
+        key = tuple(annotations.get(name) for name in annotation_map) + (annotations["color"],)
+    try:
+        return _annotation_wrappers[key]
+    except KeyError:
+        pass
+
+    transfers = [transfer for name, transfer in annotation_map.items() if annotations.get(name)]
+    color_name = annotations["color"]
+    if color_name != "default":
+        transfers.append(lambda content: color(content, color_name))
+    if not transfers:
+        wrapper = None
+    elif len(transfers) == 1:
+        wrapper = transfers[0]
+    else:
+        def wrapper(content):
+            for transfer in transfers:
+                content = transfer(content)
+            return content
+    _annotation_wrappers[key] = wrapper
+    return wrapper
+
 # Mentions
 
 
@@ -377,19 +475,13 @@ def richtext_word_converter(richtext: dict, title_mode=False) -> str:
         if title_mode:
             outcome_word = plain_text
             return outcome_word
-        if "href" in richtext:
-            if richtext["href"]:
-                outcome_word = text_link(richtext["text"])
-            else:
-                outcome_word = plain_text
+        if richtext.get("href"):
+            outcome_word = text_link(richtext["text"])
         else:
             outcome_word = plain_text
-        annot = richtext["annotations"]
-        for key, transfer in annotation_map.items():
-            if richtext["annotations"][key]:
-                outcome_word = transfer(outcome_word)
-        if annot["color"] != "default":
-            outcome_word = color(outcome_word, annot["color"])
+        wrapper = annotation_wrapper(richtext["annotations"])
+        if wrapper is not None:
+            outcome_word = wrapper(outcome_word)
     return outcome_word
 
 
@@ -398,44 +490,160 @@ def richtext_convertor(richtext_list: list, title_mode=False) -> str:
     title_mode: bool flag is needed for headers parsing (in case they contain)
     any latex expressions.
     """
-    outcome_sentence = ""
-    for richtext in richtext_list:
-        outcome_sentence += richtext_word_converter(richtext, title_mode)
-    return outcome_sentence
-
-
-def grouping(page_md: str) -> str:
-    page_md_fixed = []
-    prev_line_type = ''
-    for line in page_md.splitlines():
-        line_type = ''
-        norm_line = line.lstrip('\t').lstrip()
-        if norm_line.startswith('- [ ]') or norm_line.startswith('- [x]'):
-            line_type = 'checkbox'
-        elif norm_line.startswith('* '):
-            line_type = 'bullet'
-        elif norm_line.startswith('1. '):
-            line_type = 'numbered'
-
-        if prev_line_type != '':
-            if line == '':
-                continue
+    return "".join([
+        richtext_word_converter(richtext, title_mode) for richtext in richtext_list
+    ])
 
-        if line_type != prev_line_type:
-            page_md_fixed.append('')
 
-        page_md_fixed.append(line)
-        prev_line_type = line_type
-    return "\n".join(page_md_fixed)
+# Registry
 
 
-def parse_markdown(page_id: str, block: dict, frontmatter: dict):
-    metadata = '---\n'
+def register_block(block_type: str, render, container=False):
+    """Renders the blocks of 'block_type' with 'render', which takes a `Block`
+    and returns its markdown, in place of the renderer of the type if any.
+    The children of 'container' blocks are rendered as their siblings."""
+    block_type_map[block_type] = render
+    if container:
+        container_types.add(block_type)
+    else:
+        container_types.discard(block_type)
+
+
+def register_annotation(name: str, wrap):
+    """Applies 'wrap' (markdown → markdown) to the text runs with the 'name'
+    annotation, after the annotations registered before it"""
+    global _annotation_key
+    annotation_map[name] = wrap
+    _annotation_key = itemgetter(*annotation_map, "color")
+    _annotation_wrappers.clear()
+
+
+def register_mention(mention_type: str, render):
+    """Renders the mentions of 'mention_type' with 'render', which takes
+    their `mention_information`"""
+    mention_map[mention_type] = render
+
+
+def import_renderers(modules):
+    """Imports the modules registering custom renderers, which has to be done
+    in every process rendering pages"""
+    for module in modules:
+        importlib.import_module(module)
+
+
+# Characters str.splitlines() breaks lines on
+LINE_BREAKS = "\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029"
+
+
+def collapsed_newlines(count: int) -> str:
+    """A run of 'count' newlines after `.replace("\\n\\n\\n", "\\n\\n")`"""
+    if count < len(COLLAPSED_NEWLINES):
+        return COLLAPSED_NEWLINES[count]
+    return "\n" * (2 * (count // 3) + count % 3)
+
+
+COLLAPSED_NEWLINES = [
+    "\n" * (2 * (count // 3) + count % 3) for count in range(16)
+]
+
+
+def line_type_of(line: str) -> str:
+    norm_line = line.lstrip('\t').lstrip()
+    if norm_line.startswith('- [ ]') or norm_line.startswith('- [x]'):
+        return 'checkbox'
+    elif norm_line.startswith('* '):
+        return 'bullet'
+    elif norm_line.startswith('1. '):
+        return 'numbered'
+    return ''
+
+
+class MarkdownPostprocessor:
+    """Groups list items and collapses "\n\n\n" into "\n\n" in one pass.
+
+    Runs of checkboxes, bullets and numbered items are kept together: empty
+    lines inside a run are dropped, and an empty line separates lines of
+    different kinds. Rendered markdown is fed fragment by fragment (it can
+    stand in for the fragment list of `write_block`), so the page is never
+    joined and split again.
+    'header' is output verbatim before the processed markdown.
+    The output can be taken in pieces with `drain` as it is fed.
+    """
+
+    def __init__(self, header: str = ""):
+        self.fragments = [header]
+        self.partial = ""
+        self.prev_line_type = ''
+        self.started = False
+        self.newlines = 0
+
+    def append(self, text: str):
+        text = self.partial + text
+        self.partial = ""
+        lines = text.splitlines()
+        # The last line may go on in the next fragment, and a trailing "\r"
+        # may be the first half of a "\r\n"
+        if text and (text[-1] not in LINE_BREAKS or text[-1] == "\r"):
+            self.partial = lines.pop() + ("\r" if text[-1] == "\r" else "")
+        self.feed_lines(lines)
+
+    def feed_lines(self, lines: list):
+        # Lines are joined by "\n", so only the length of each run of
+        # newlines has to be tracked to collapse it as str.replace would
+        fragments = self.fragments
+        prev_line_type = self.prev_line_type
+        newlines = self.newlines
+        started = self.started
+        for line in lines:
+            if not line:
+                if prev_line_type == '':
+                    newlines += started
+                    started = True
+                continue
+            line_type = line_type_of(line)
+            if line_type != prev_line_type:
+                # The empty line separating kinds of lines
+                newlines += started
+                started = True
+                prev_line_type = line_type
+            newlines += started
+            started = True
+            if newlines:
+                fragments.append(collapsed_newlines(newlines))
+                newlines = 0
+            fragments.append(line)
+        self.prev_line_type = prev_line_type
+        self.newlines = newlines
+        self.started = started
+
+    def getvalue(self) -> str:
+        if self.partial:
+            self.feed_lines(self.partial.splitlines())
+            self.partial = ""
+        if self.newlines:
+            self.fragments.append(collapsed_newlines(self.newlines))
+            self.newlines = 0
+        return "".join(self.fragments)
+
+    def drain(self) -> str:
+        """The output of the lines fed so far, which `getvalue` then leaves
+        out. Lines still open and trailing newlines are held back."""
+        text = "".join(self.fragments)
+        self.fragments = []
+        return text
+
+
+def frontmatter_header(frontmatter: dict) -> str:
+    metadata = ['---\n']
     for key, value in frontmatter.items():
-        metadata += f"{utils.snake_case(key)}: {value}\n"
-    metadata += f"---\n\n"
+        metadata.append(f"{utils.snake_case(key)}: {value}\n")
+    metadata.append("---\n\n")
+    return "".join(metadata)
 
-    page_md = blocks_convertor(block, page_id)
-    page_md = grouping(page_md)
-    page_md = page_md.replace("\n\n\n", "\n\n")
-    return metadata + page_md
+
+def parse_markdown(page_id: str, block: dict, frontmatter: dict):
+    page_md = MarkdownPostprocessor(frontmatter_header(frontmatter))
+    # Fragments go straight into the postprocessor, the page is never joined and split
+    for child in block["results"]:
+        write_block(page_md, decode_block(child), 0, page_id)
+    return page_md.getvalue()
@@ -1,18 +1,109 @@
+import asyncio
+import collections
+
 from notion_client import AsyncClient
 
 
-async def parse_blocks(block: dict, notion: "AsyncClient")-> dict:
-    if block["has_children"]:
-        block["children"] = []
-        start_cursor = None
-        while True:
-            if start_cursor is None:
-                blocks = await notion.blocks.children.list(block["id"])
-            start_cursor = blocks["next_cursor"]
-            block["children"].extend(blocks['results'])
-            if start_cursor is None:
-                break
-
-        for child_block in block["children"]:
-            await parse_blocks(child_block, notion)
-    return block
+async def paginate_responses(method, start_cursor: str = None, **kwargs):
+    """Yields every cursor page of a paginated endpoint, from 'start_cursor' on.
+
+    The request for the next cursor page is sent before the current one is
+    handed out, so callers can process a batch while the next one is in flight.
+    """
+    async def fetch(start_cursor):
+        if start_cursor is None:
+            return await method(**kwargs)
+        return await method(start_cursor=start_cursor, **kwargs)
+
+    pending = asyncio.ensure_future(fetch(start_cursor))
+    try:
+        while pending is not None:
+            response = await pending
+            next_cursor = response.get("next_cursor")
+            pending = asyncio.ensure_future(fetch(next_cursor)) if next_cursor else None
+            yield response
+    finally:
+        if pending is not None:
+            pending.cancel()
+
+
+async def paginate_batches(method, **kwargs):
+    """Yields the `results` of every cursor page of a paginated endpoint, see `paginate_responses`"""
+    async for response in paginate_responses(method, **kwargs):
+        yield response["results"]
+
+
+async def paginate(method, **kwargs):
+    """Yields the results of a paginated endpoint one by one, see `paginate_batches`"""
+    async for batch in paginate_batches(method, **kwargs):
+        for result in batch:
+            yield result
+
+
+async def fetch_children(block_id: str, notion: "AsyncClient") -> list:
+    return [block async for block in paginate(notion.blocks.children.list, block_id=block_id)]
+
+
+async def fetch_block_tree(blocks: list, notion: "AsyncClient", skip_types=()) -> list:
+    """Expands the children of 'blocks' breadth-first.
+
+    Every `blocks.children.list` call of a level is issued concurrently, so the
+    number of round trips grows with the depth of the tree rather than with its
+    size; the client's request scheduler bounds the calls actually in flight.
+    Blocks of 'skip_types' are left unexpanded.
+    """
+    level = blocks
+    while level:
+        parents = [block for block in level if block["has_children"] and block["type"] not in skip_types]
+        children = await asyncio.gather(*[
+            fetch_children(block["id"], notion) for block in parents
+        ])
+        level = []
+        for block, block_children in zip(parents, children):
+            block["children"] = block_children
+            level.extend(block_children)
+    return blocks
+
+
+async def fetch_page_blocks(page_id: str, notion: "AsyncClient", skip_types=()) -> list:
+    """Fetches the whole block tree of a page.
+
+    The subtree of each batch of top-level blocks is expanded while the next
+    batch of the page body is still being fetched.
+    """
+    tasks = []
+    try:
+        async for batch in paginate_batches(notion.blocks.children.list, block_id=page_id):
+            tasks.append(asyncio.ensure_future(fetch_block_tree(batch, notion, skip_types)))
+        results = []
+        for batch in await asyncio.gather(*tasks):
+            results.extend(batch)
+        return results
+    finally:
+        # Subtrees still being expanded when a request failed or the page was cancelled
+        for task in tasks:
+            task.cancel()
+
+
+async def stream_page_blocks(page_id: str, notion: "AsyncClient", skip_types=(), window=4):
+    """Yields the top-level blocks of a page in order, each with its subtree
+    expanded, while the subtrees of the next 'window' blocks are fetched.
+
+    Unlike `fetch_page_blocks`, only the blocks in the window are held, so
+    memory does not grow with the size of the page.
+    """
+    pending = collections.deque()
+    try:
+        async for batch in paginate_batches(notion.blocks.children.list, block_id=page_id):
+            # Popped in place, the batch stops referencing handed out blocks
+            batch.reverse()
+            while batch:
+                pending.append(asyncio.ensure_future(fetch_block_tree([batch.pop()], notion, skip_types)))
+                if len(pending) > window:
+                    yield (await pending.popleft())[0]
+        while pending:
+            yield (await pending.popleft())[0]
+    finally:
+        for task in pending:
+            task.cancel()
+
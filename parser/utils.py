@@ -1,4 +1,5 @@
 import re
+from functools import lru_cache
 
 def slugify(filename):
     # Remove all characters that are not allowed in filenames
@@ -7,6 +8,8 @@ def slugify(filename):
     safe_filename = re.sub(r'\s+', '-', safe_filename)
     return safe_filename
 
+# Front matter keys are the property names of a few schemas
+@lru_cache(maxsize=1024)
 def snake_case(s):
   return '_'.join(
     re.sub('([A-Z][a-z]+)', r' \1',
@@ -0,0 +1,25 @@
+import sys
+import getopt
+
+from exporter.rerender import rerender_database
+
+
+if __name__ == "__main__":
+    argv = sys.argv[1:]
+    try:
+        opts, args = getopt.getopt(argv, 'p:', ['path=', 'workers=', 'renderers='])
+        path = ""
+        workers = None
+        renderers = []
+        for arg, val in opts:
+            if arg in ("-p", "--path"):
+                path = val
+            if arg == "--workers":
+                workers = int(val)
+            if arg == "--renderers":
+                renderers = val.split(",")
+        changed = rerender_database(path, workers, renderers)
+        print(f"{changed} markdown files changed")
+
+    except getopt.error as err:
+        print(str(err))
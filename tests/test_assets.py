@@ -0,0 +1,30 @@
+import asyncio
+
+from exporter.assets import AssetStore
+
+
+class FlakyStore(AssetStore):
+    """Fails the first 'failures' downloads with an OSError"""
+
+    def __init__(self, path: str, failures: int):
+        super().__init__(path, retries=0)
+        self.failures = failures
+
+    async def _download(self, url: str) -> str:
+        if self.failures:
+            self.failures -= 1
+            raise OSError("No space left on device")
+        return "stored.png"
+
+
+def test_failed_downloads_are_retried_by_later_pages(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    store = FlakyStore("db", failures=1)
+
+    async def run():
+        failed = await store.fetch("https://files.example.com/image.png?X-Amz-Signature=1")
+        assert not store.downloads
+        return failed, await store.fetch("https://files.example.com/image.png?X-Amz-Signature=2")
+
+    assert asyncio.run(run()) == (None, "stored.png")
+    assert list(store.index.values()) == ["stored.png"]
@@ -0,0 +1,69 @@
+import json
+import os
+
+from exporter.checkpoint import Checkpoint
+
+
+def row(page_id: str) -> dict:
+    return {"id": page_id, "last_edited_time": "2024-01-01T00:00:00.000Z"}
+
+
+def test_resume_skips_done_pages_and_retries_failed_ones(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    checkpoint = Checkpoint("db", "database", query={"filter": {"property": "Status"}})
+    checkpoint.add_batch("cursor-1", ["a", "b"], ["a", "b"])
+    checkpoint.page_done("a", {"slug": "A"})
+    checkpoint.page_failed(row("b"), "fetch", OSError("reset"))
+    checkpoint.add_batch("cursor-2", ["c"], ["c"])
+    # Interrupted before 'c' settled
+    checkpoint.journal.close()
+
+    resumed = Checkpoint("db", "database", resume=True, query={"filter": {"property": "Status"}})
+    assert resumed.cursor == "cursor-1"
+    assert list(resumed.done) == ["a"]
+    assert resumed.retry_rows() == [row("b")]
+    assert resumed.failed["b"]["error"] == "OSError: reset"
+
+
+def test_resume_ignores_the_journal_of_another_query(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    checkpoint = Checkpoint("db", "database")
+    checkpoint.add_batch(None, ["a"], ["a"])
+    checkpoint.page_done("a", {"slug": "A"})
+    checkpoint.journal.close()
+
+    resumed = Checkpoint("db", "database", resume=True, query={"sorts": [{"property": "Date"}]})
+    assert resumed.cursor is None and not resumed.done
+
+
+def test_batches_settle_in_query_order(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    checkpoint = Checkpoint("db", "database")
+    checkpoint.add_batch("cursor-1", ["a"], ["a"])
+    checkpoint.add_batch("cursor-2", ["b"], ["b"])
+    checkpoint.page_done("b", {})
+    checkpoint.journal.close()
+    assert Checkpoint("db", "database", resume=True).cursor is None
+
+    checkpoint = Checkpoint("db", "database", resume=True)
+    checkpoint.add_batch("cursor-1", ["a"], ["a"])
+    checkpoint.add_batch("cursor-2", ["b"], ["b"])
+    checkpoint.page_done("b", {})
+    checkpoint.page_done("a", {})
+    checkpoint.journal.close()
+    assert Checkpoint("db", "database", resume=True).cursor == "cursor-2"
+
+
+def test_finish_writes_failures_or_removes_the_journal(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    checkpoint = Checkpoint("db", "database")
+    checkpoint.page_failed(row("a"), "render", ValueError("bad block"))
+    checkpoint.finish()
+    with open("build/db/failures.json") as f:
+        assert json.load(f)["a"]["stage"] == "render"
+
+    checkpoint = Checkpoint("db", "database", resume=True)
+    checkpoint.page_done("a", {})
+    checkpoint.finish()
+    assert not os.path.exists("build/db/failures.json")
+    assert not os.path.exists("build/db/checkpoint.jsonl")
@@ -0,0 +1,18 @@
+from exporter.crawl import rewrite_links
+
+PAGE_ID = "0123456789abcdef0123456789abcdef"
+LINKS = {PAGE_ID: ("Roadmap", "../roadmap/")}
+
+
+def test_rewrite_links_points_at_crawled_pages():
+    url = f"https://www.notion.so/{PAGE_ID}"
+    assert rewrite_links(f"See [{url}]({url}).", LINKS) == "See [Roadmap](../roadmap/)."
+    assert rewrite_links(f"[the plan](https://www.notion.so/Roadmap-{PAGE_ID}?pvs=4)", LINKS) == (
+        "[the plan](../roadmap/)"
+    )
+
+
+def test_rewrite_links_leaves_other_links():
+    other = "https://www.notion.so/fedcba9876543210fedcba9876543210"
+    page_md = f"[elsewhere]({other}) and [a site](https://example.com/{PAGE_ID})"
+    assert rewrite_links(page_md, LINKS) == page_md
@@ -0,0 +1,25 @@
+from exporter.dumps import DumpStream, block_listing, decode_json, dump_page, encode_json
+
+
+def test_encode_json_keeps_non_ascii_text():
+    page = {"title": "Café ☕", "blocks": ["日本語"]}
+    for pretty in (False, True):
+        data = encode_json(page, pretty)
+        assert "Café ☕".encode("utf-8") in data
+        assert decode_json(data) == page
+
+
+def test_streamed_blocks_dump_matches_dump_page(tmp_path):
+    blocks = [{"id": "b1", "type": "paragraph", "children": [{"id": "b2"}]}, {"id": "b3", "type": "divider"}]
+    for dump_format in ("pretty", "minified"):
+        for results in (blocks, []):
+            dump = DumpStream(str(tmp_path), "page", {"id": "page"}, dump_format)
+            for block in results:
+                dump.add(block)
+            dump.close()
+            (name, output), = dump.streamed.items()
+            output.close()
+            with open(output.tmp_path, "rb") as f:
+                data = f.read()
+            assert data == dump_page("page", {"id": "page"}, block_listing(results), dump_format)[name]
+            assert decode_json(data)["has_more"] is False
@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+
+from exporter.filters import database_query, parse_condition, parse_since, parse_sort, property_condition
+
+SCHEMA = {
+    "Name": {"id": "title", "type": "title"},
+    "Status": {"id": "s%3A", "type": "status"},
+    "Tags": {"id": "t%3A", "type": "multi_select"},
+    "Done": {"id": "d%3A", "type": "checkbox"},
+    "Date": {"id": "D%3A", "type": "date"},
+}
+
+
+class Databases:
+    async def retrieve(self, database_id):
+        return {"id": database_id, "properties": SCHEMA}
+
+
+class Notion:
+    databases = Databases()
+
+
+def test_parse_condition():
+    assert parse_condition(" Status = Published ") == ("Status", "Published")
+    with pytest.raises(ValueError):
+        parse_condition("Status")
+
+
+def test_parse_since():
+    assert parse_since("2024-05-01") == "2024-05-01"
+    assert parse_since("2024-05-01T00:00:00Z") == "2024-05-01T00:00:00Z"
+    assert parse_since("2024-05-01T09:30:00.000+02:00") == "2024-05-01T09:30:00.000+02:00"
+    assert len(parse_since("7d")) == len("2024-05-01")
+    with pytest.raises(ValueError):
+        parse_since("last week")
+
+
+def test_property_condition():
+    assert property_condition("Tags", SCHEMA["Tags"], "go") == {"property": "Tags", "multi_select": {"contains": "go"}}
+    assert property_condition("Done", SCHEMA["Done"], "yes") == {"property": "Done", "checkbox": {"equals": True}}
+    with pytest.raises(ValueError):
+        property_condition("Files", {"type": "files"}, "x")
+
+
+def test_parse_sort():
+    assert parse_sort(SCHEMA, "Date:descending") == {"property": "Date", "direction": "descending"}
+    assert parse_sort(SCHEMA, "last_edited_time") == {"timestamp": "last_edited_time", "direction": "ascending"}
+    with pytest.raises(ValueError):
+        parse_sort(SCHEMA, "Date:up")
+    with pytest.raises(ValueError):
+        parse_sort(SCHEMA, "Missing")
+
+
+def test_database_query():
+    query = asyncio.run(database_query(
+        Notion(), "database", where=["Tags=go"], edited_after="2024-05-01", statuses=["Draft", "Published"],
+        sorts=["Date"], properties=["Date"],
+    ))
+    assert query == {
+        "filter": {"and": [
+            {"property": "Tags", "multi_select": {"contains": "go"}},
+            {"timestamp": "last_edited_time", "last_edited_time": {"after": "2024-05-01"}},
+            {"or": [
+                {"property": "Status", "status": {"equals": "Draft"}},
+                {"property": "Status", "status": {"equals": "Published"}},
+            ]},
+        ]},
+        "sorts": [{"property": "Date", "direction": "ascending"}],
+        "filter_properties": ["title", "D%3A"],
+    }
+    assert asyncio.run(database_query(Notion(), "database")) == {}
@@ -0,0 +1,51 @@
+import json
+import os
+
+from exporter.manifest import load_manifest, prune_pages, record_page, save_manifest
+
+
+def write_output(path: str, output: str):
+    os.makedirs(os.path.dirname(f"build/{path}/{output}"), exist_ok=True)
+    with open(f"build/{path}/{output}", "w") as f:
+        f.write(output)
+
+
+def test_record_page_removes_stale_outputs(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    manifest = load_manifest("db")
+    for output in ("a/Old.md", "_markdown/Old.md"):
+        write_output("db", output)
+    record_page(manifest, "db", "a", "t1", "Old", {"a/Old.md": "1", "_markdown/Old.md": "1"})
+    write_output("db", "a/New.md")
+    record_page(manifest, "db", "a", "t2", "New", {"a/New.md": "2"})
+
+    assert not os.path.exists("build/db/a/Old.md")
+    assert not os.path.exists("build/db/_markdown")
+    assert os.path.exists("build/db/a/New.md")
+
+
+def test_outputs_claimed_by_another_page_are_kept(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_output("db", "_markdown/Shared.md")
+    save_manifest("db", {"pages": {
+        "a": {"last_edited_time": "t1", "slug": "Shared", "outputs": {"_markdown/Shared.md": "1"}},
+        "b": {"last_edited_time": "t1", "slug": "Shared", "outputs": {"_markdown/Shared.md": "1"}},
+    }})
+    manifest = load_manifest("db")
+    record_page(manifest, "db", "a", "t2", "Renamed", {})
+    assert os.path.exists("build/db/_markdown/Shared.md")
+
+    assert prune_pages(manifest, "db", {"a"}) == ["b"]
+    assert not os.path.exists("build/db/_markdown/Shared.md")
+
+
+def test_saved_manifest_leaves_out_the_index(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    manifest = load_manifest("db")
+    record_page(manifest, "db", "a", "t1", "A", {"a/A.md": "1"}, depth=1)
+    save_manifest("db", manifest)
+
+    with open("build/db/manifest.json") as f:
+        saved = json.load(f)
+    assert saved == {"pages": {"a": {"last_edited_time": "t1", "slug": "A", "outputs": {"a/A.md": "1"}, "depth": 1}}}
+    assert load_manifest("db")["pages"] == saved["pages"]
@@ -0,0 +1,70 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+from exporter.checkpoint import Checkpoint
+from exporter.pipeline import DONE, gather_or_cancel, write_pages
+from exporter.writer import OutputWriter
+
+
+class FailingWriter(OutputWriter):
+    """Fails to write the pages of 'failing'"""
+
+    def __init__(self, failing: set):
+        super().__init__()
+        self.failing = failing
+
+    def write_outputs(self, root, files, links=None, previous=None, streamed=None):
+        if any(output.split("/")[0] in self.failing for output in files):
+            raise OSError("No space left on device")
+        return super().write_outputs(root, files, links, previous, streamed)
+
+
+def rendered_page(page_id: str) -> tuple:
+    row = {"id": page_id, "last_edited_time": "2024-01-01T00:00:00.000Z"}
+    return row, {"title": f"Page {page_id}", "markdown": f"# {page_id}\n", "dumps": {}}
+
+
+def test_write_pages_isolates_failures(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    manifest = {"pages": {}}
+    checkpoint = Checkpoint("db", "database")
+
+    async def run():
+        write_queue = asyncio.Queue()
+        for page_id in ("a", "b", "c"):
+            write_queue.put_nowait(rendered_page(page_id))
+        write_queue.put_nowait(DONE)
+        return await write_pages("db", write_queue, manifest, FailingWriter({"b"}), checkpoint)
+
+    assert asyncio.run(run()) == 2
+    checkpoint.finish()
+
+    assert sorted(manifest["pages"]) == ["a", "c"]
+    assert os.path.exists("build/db/c/Page c.md")
+    with open("build/db/failures.json") as f:
+        failures = json.load(f)
+    assert list(failures) == ["b"]
+    assert failures["b"]["stage"] == "write"
+    assert failures["b"]["error"] == "OSError: No space left on device"
+
+
+def test_gather_or_cancel_cancels_the_other_coroutines():
+    cancelled = []
+
+    async def worker():
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def failing():
+        await asyncio.sleep(0)
+        raise ValueError("failed")
+
+    with pytest.raises(ValueError):
+        asyncio.run(gather_or_cancel(worker(), worker(), failing()))
+    assert cancelled == [True, True]